@@ -0,0 +1,295 @@
+"""Аналитика по истории заказов: выгрузка в дневные разделы и запросы к ним.
+
+    python analytics.py export orders.db analytics/
+    python analytics.py export orders.db analytics/ --since 2030-01-01
+    python analytics.py query analytics/ --by date,product
+    python analytics.py query analytics/ --by month --from 2030-01-01 --to 2030-12-31 --status dumped
+    python analytics.py utilisation analytics/ --from 2030-06-01
+    python analytics.py generate analytics/ --days 730 --orders-per-day 150   # синтетика для замеров
+"""
+import argparse
+import csv
+import gzip
+import os
+import random
+import sqlite3
+import time
+from collections import Counter, defaultdict
+from datetime import date as Date, datetime, timedelta
+
+from orders import PRODUCTS, SLOT_CAPACITY, SCHEMA, parse_date
+
+# 📊 Один файл на день: analytics/orders-ГГГГ-ММ-ДД.csv.gz.
+# Личные данные (имя, адрес, user_id) в выгрузку не попадают
+COLUMNS = [
+    "id", "date", "time_slot", "product", "transfer", "price", "status",
+    "created_at", "confirmed_at", "picked_up_at", "dumped_at",
+]
+PREFIX = "orders-"
+SUFFIX = ".csv.gz"
+# Поля группировки, общие для всего раздела, берутся из имени файла, а не из строк
+PARTITION_KEYS = {
+    "date": lambda day: day.isoformat(),
+    "month": lambda day: day.strftime("%Y-%m"),
+    "year": lambda day: str(day.year),
+    "weekday": lambda day: str(day.isoweekday()),
+}
+GROUP_KEYS = [*PARTITION_KEYS, "time_slot", "product", "transfer", "status"]
+SLOTS = [f"{hour}:00" for hour in range(8, 21)]
+TRANSFERS = ["Выставлен за дверь", "Курьер поднимется"]
+STATUSES = ["pending_payment", "confirmed", "picked_up", "dumped"]
+
+
+def partition_path(directory, day):
+    return os.path.join(directory, f"{PREFIX}{day.isoformat()}{SUFFIX}")
+
+
+def partitions(directory, start=None, end=None):
+    # Разделы в порядке дат; лишние дни отсекаются по имени файла, не открывая его
+    days = []
+    for name in os.listdir(directory):
+        if not (name.startswith(PREFIX) and name.endswith(SUFFIX)):
+            continue
+        try:
+            day = Date.fromisoformat(name[len(PREFIX):-len(SUFFIX)])
+        except ValueError:
+            continue
+        if (start is None or day >= start) and (end is None or day <= end):
+            days.append(day)
+    for day in sorted(days):
+        yield day, partition_path(directory, day)
+
+
+def write_partition(directory, day, rows):
+    # Запись во временный файл и переименование: читатель не увидит раздел наполовину
+    path = partition_path(directory, day)
+    tmp = f"{path}.tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8", newline="", compresslevel=6) as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        count = 0
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    os.replace(tmp, path)
+    return count
+
+
+def read_partition(path):
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        index = {name: i for i, name in enumerate(header)}
+        yield index
+        yield from reader
+
+
+# 📤 Выгрузка из orders.db. Заказы читаются по одному дню через индекс (date, time_slot),
+# поэтому в памяти никогда не лежит больше одного дня
+def export(db_path, directory, since=None):
+    os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        raw_dates = [row[0] for row in conn.execute("SELECT DISTINCT date FROM orders")]
+        days = {}
+        skipped = 0
+        for raw in raw_dates:
+            day = parse_date(raw)
+            if day == datetime.max.date():
+                skipped += conn.execute("SELECT COUNT(*) FROM orders WHERE date IS ?", (raw,)).fetchone()[0]
+            elif since is None or day >= since:
+                days.setdefault(day, []).append(raw)
+
+        total = 0
+        for day in sorted(days):
+            rows = (
+                export_row(day, row)
+                for raw in days[day]
+                for row in conn.execute(
+                    "SELECT id, time_slot, product, transfer, price, status, "
+                    "created_at, confirmed_at, picked_up_at, dumped_at FROM orders WHERE date = ? ORDER BY id",
+                    (raw,),
+                )
+            )
+            total += write_partition(directory, day, rows)
+        return {"days": len(days), "orders": total, "skipped": skipped}
+    finally:
+        conn.close()
+
+
+def export_row(day, row):
+    order_id, time_slot, product, transfer, price, status, *stamps = row
+    if price in (None, ""):
+        # Заказы, перенесённые из orders.csv, могли остаться без суммы
+        price = PRODUCTS.get(product, 0)
+    return [order_id, day.isoformat(), time_slot, product, transfer, price, status, *(s or "" for s in stamps)]
+
+
+# 🔎 Запросы: потоковая агрегация по разделам, в памяти только итоговые группы
+def aggregate(directory, by, start=None, end=None, statuses=None):
+    totals = defaultdict(lambda: [0, 0])  # группа -> [заказов, сумма]
+    for day, path in partitions(directory, start, end):
+        rows = read_partition(path)
+        index = next(rows, None)
+        if index is None:
+            continue
+        # Для каждого поля группировки — либо значение раздела, либо номер колонки
+        fixed = {key: PARTITION_KEYS[key](day) for key in by if key in PARTITION_KEYS}
+        columns = [(key, index.get(key)) for key in by]
+        price_at, status_at = index["price"], index["status"]
+        if len(fixed) == len(by):
+            # Группировка только по полям раздела: из строк нужны лишь цена и статус
+            group = totals[tuple(fixed[key] for key in by)]
+            for row in rows:
+                if statuses is None or row[status_at] in statuses:
+                    group[0] += 1
+                    group[1] += int(row[price_at] or 0)
+            continue
+        for row in rows:
+            if statuses is not None and row[status_at] not in statuses:
+                continue
+            group = totals[tuple(fixed[key] if key in fixed else row[at] for key, at in columns)]
+            group[0] += 1
+            group[1] += int(row[price_at] or 0)
+    return totals
+
+
+def utilisation(directory, start=None, end=None, capacity=SLOT_CAPACITY):
+    # Заполненность слотов: по каждому часу — сколько заказов в среднем из capacity
+    # и сколько дней слот был занят полностью
+    orders = Counter()
+    full = Counter()
+    days = 0
+    for day, path in partitions(directory, start, end):
+        rows = read_partition(path)
+        index = next(rows, None)
+        if index is None:
+            continue
+        days += 1
+        slot_at = index["time_slot"]
+        counts = Counter(row[slot_at] for row in rows)
+        orders.update(counts)
+        full.update(slot for slot, count in counts.items() if count >= capacity)
+    return days, {slot: (orders[slot], full[slot]) for slot in orders}
+
+
+# 🧪 Синтетическая история для замеров
+def synthetic_orders(rng, day, count, first_id):
+    products = list(PRODUCTS.items())
+    for i in range(count):
+        product, price = rng.choice(products)
+        created = datetime.combine(day, datetime.min.time()) - timedelta(minutes=rng.randint(10, 24 * 60))
+        status = rng.choices(STATUSES, weights=(1, 1, 1, 12))[0]
+        stamps = []
+        moment = created
+        for step in STATUSES[1:]:
+            moment += timedelta(minutes=rng.randint(5, 240))
+            stamps.append(moment.isoformat(timespec="seconds") if STATUSES.index(step) <= STATUSES.index(status) else "")
+        yield [
+            first_id + i, day.isoformat(), rng.choice(SLOTS), product, rng.choice(TRANSFERS), price, status,
+            created.isoformat(timespec="seconds"), *stamps,
+        ]
+
+
+def generate(directory, days, orders_per_day, seed=1, db_path=None):
+    # Разделы за days дней до сегодняшнего; с db_path — те же заказы ещё и в orders.db для замера export
+    rng = random.Random(seed)
+    today = datetime.now().date()
+    os.makedirs(directory, exist_ok=True)
+    conn = None
+    if db_path:
+        conn = sqlite3.connect(db_path)
+        conn.executescript(SCHEMA)
+    next_id = 1
+    try:
+        for offset in range(days, 0, -1):
+            day = today - timedelta(days=offset)
+            count = max(0, int(rng.gauss(orders_per_day, orders_per_day * 0.2)))
+            rows = list(synthetic_orders(rng, day, count, next_id))
+            next_id += count
+            write_partition(directory, day, rows)
+            if conn is not None:
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO orders (id, date, time_slot, product, transfer, price, status, "
+                        "created_at, confirmed_at, picked_up_at, dumped_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        ([row[0], day.strftime("%d.%m.%Y"), *row[2:]] for row in rows),
+                    )
+    finally:
+        if conn is not None:
+            conn.close()
+    return next_id - 1
+
+
+def print_rows(header, rows):
+    widths = [max(len(str(value)) for value in column) for column in zip(header, *rows)]
+    print("  ".join(str(value).ljust(width) for value, width in zip(header, widths)))
+    for row in rows:
+        print("  ".join(str(value).ljust(width) for value, width in zip(row, widths)))
+
+
+def day_arg(value):
+    return Date.fromisoformat(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Аналитика по истории заказов")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="выгрузить orders.db в дневные разделы")
+    export_parser.add_argument("db")
+    export_parser.add_argument("directory")
+    export_parser.add_argument("--since", type=day_arg, help="перезаписать разделы начиная с даты ГГГГ-ММ-ДД")
+
+    query_parser = commands.add_parser("query", help="заказы и выручка по группам")
+    query_parser.add_argument("directory")
+    query_parser.add_argument("--by", default="date", help=f"через запятую: {', '.join(GROUP_KEYS)}")
+    query_parser.add_argument("--status", help="только эти статусы, через запятую")
+
+    slots_parser = commands.add_parser("utilisation", help="заполненность временных слотов")
+    slots_parser.add_argument("directory")
+    slots_parser.add_argument("--capacity", type=int, default=SLOT_CAPACITY)
+
+    for sub in (query_parser, slots_parser):
+        sub.add_argument("--from", dest="start", type=day_arg)
+        sub.add_argument("--to", dest="end", type=day_arg)
+
+    generate_parser = commands.add_parser("generate", help="синтетические разделы для замеров")
+    generate_parser.add_argument("directory")
+    generate_parser.add_argument("--days", type=int, default=730)
+    generate_parser.add_argument("--orders-per-day", type=int, default=150)
+    generate_parser.add_argument("--seed", type=int, default=1)
+    generate_parser.add_argument("--db", help="записать те же заказы в SQLite-базу для замера export")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.command == "export":
+        result = export(args.db, args.directory, args.since)
+        print(f"Выгружено заказов: {result['orders']} за {result['days']} дн., без даты пропущено: {result['skipped']}")
+    elif args.command == "query":
+        by = [key.strip() for key in args.by.split(",") if key.strip()]
+        unknown = [key for key in by if key not in GROUP_KEYS]
+        if unknown:
+            parser.error(f"неизвестные поля группировки: {', '.join(unknown)}")
+        statuses = set(args.status.split(",")) if args.status else None
+        totals = aggregate(args.directory, by, args.start, args.end, statuses)
+        rows = [(*group, count, revenue) for group, (count, revenue) in sorted(totals.items())]
+        print_rows([*by, "orders", "revenue"], rows)
+    elif args.command == "utilisation":
+        days, slots = utilisation(args.directory, args.start, args.end, args.capacity)
+        rows = [
+            (slot, orders, round(orders / days, 1), f"{orders / (days * args.capacity):.0%}", full)
+            for slot, (orders, full) in sorted(slots.items(), key=lambda item: int(item[0].split(":")[0]))
+        ]
+        print(f"Дней: {days}")
+        print_rows(["time_slot", "orders", "per_day", "filled", "full_days"], rows)
+    else:
+        total = generate(args.directory, args.days, args.orders_per_day, args.seed, args.db)
+        print(f"Сгенерировано заказов: {total}")
+    print(f"⏱ {time.perf_counter() - started:.2f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,544 @@
+"""Нагрузочный тест бота: синтетические обновления через /webhook и заглушка Bot API.
+
+    python bench.py --users 200 --storage sqlite --mode queue
+    python bench.py --compare
+    python bench.py --workers 4 --storage sqlite   # bot.py в режиме WORKERS=4 в отдельном процессе
+    python bench.py --manifest --days 30 --orders-per-day 5000
+    python bench.py --serve-stub 8081   # заглушка в отдельном процессе, затем --stub-url http://127.0.0.1:8081
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import resource
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import pytz
+from aiohttp import ClientSession, web
+
+from orders import encode_order_id
+
+ADMIN_ID = 1000
+GROUP_CHAT_ID = -1000
+MOSCOW = pytz.timezone("Europe/Moscow")
+
+
+# 🧪 Заглушка Bot API: отвечает на любой метод правдоподобным результатом
+# rate_limited первых send-запросов получают 429 с retry_after — для проверки повторов.
+# Отправленные сообщения пишутся в app["sent"] как (метод, chat_id, текст),
+# ответы на нажатия кнопок — в app["answers"] как текст ответа ("" — пустой ответ)
+def stub_api_app(latency=0.0, rate_limited=0, retry_after=1):
+    message_ids = itertools.count(1)
+    calls = {"count": 0, "limited": 0}
+    sent = []
+    answers = []
+    keyboards = []
+
+    async def handle(request):
+        method = request.match_info["method"].lower()
+        calls["count"] += 1
+        if latency:
+            await asyncio.sleep(latency)
+        form = await request.post()
+        chat_id = int(form.get("chat_id", GROUP_CHAT_ID))
+        if method.startswith("send") and calls["limited"] < rate_limited:
+            calls["limited"] += 1
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after},
+                },
+                status=429,
+            )
+        if method.startswith("send"):
+            sent.append((method, chat_id, form.get("text") or form.get("caption")))
+            if form.get("reply_markup"):
+                keyboards.append((chat_id, json.loads(form["reply_markup"])))
+        elif method == "answercallbackquery":
+            answers.append(form.get("text", ""))
+        message = {
+            "message_id": next(message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"},
+        }
+        if method == "sendmediagroup":
+            result = [message]
+        elif method.startswith("send"):
+            result = message
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", handle)
+    app["calls"] = calls
+    app["sent"] = sent
+    app["answers"] = answers
+    app["keyboards"] = keyboards
+    return app
+
+
+# 📨 Генерация обновлений
+class Updates:
+    def __init__(self):
+        self.ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+
+    def _message(self, user_id, chat_id=None, **fields):
+        chat_id = user_id if chat_id is None else chat_id
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"},
+            "from": self._user(user_id),
+            **fields,
+        }
+
+    def text(self, user_id, text):
+        return {"update_id": next(self.ids), "message": self._message(user_id, text=text)}
+
+    def photo(self, user_id, media_group_id=None):
+        file_id = f"photo-{user_id}-{next(self.message_ids)}"
+        photo = [{"file_id": file_id, "file_unique_id": file_id, "width": 800, "height": 600}]
+        fields = {"photo": photo}
+        if media_group_id:
+            fields["media_group_id"] = media_group_id
+        return {"update_id": next(self.ids), "message": self._message(user_id, **fields)}
+
+    def callback(self, user_id, data, chat_id=None):
+        return {
+            "update_id": next(self.ids),
+            "callback_query": {
+                "id": str(next(self.ids)),
+                "from": self._user(user_id),
+                "chat_instance": "bench",
+                "data": data,
+                "message": self._message(user_id, chat_id=chat_id, text="bench"),
+            },
+        }
+
+
+def order_funnel(updates, user_id, date, slot):
+    product = random.choice(["🧺 Один пакет мусора", "🗑️ 2–3 пакета мусора"])
+    return [
+        updates.text(user_id, "/start"),
+        updates.callback(user_id, "new_order"),
+        updates.callback(user_id, f"product_{product}"),
+        updates.callback(user_id, random.choice(["transfer_door", "transfer_up"])),
+        updates.callback(user_id, f"date_{date}"),
+        updates.callback(user_id, f"time_{slot}"),
+        updates.text(user_id, f"ул. Ленина, д. {user_id % 90 + 1}, кв. {user_id % 300}"),
+        updates.photo(user_id),
+        updates.photo(user_id),
+    ]
+
+
+def large_funnel(updates, user_id, photos):
+    album = f"album-{user_id}"
+    return [
+        updates.text(user_id, "/start"),
+        updates.callback(user_id, "new_order"),
+        updates.callback(user_id, "product_🛢 Крупный мусор"),
+        updates.text(user_id, "Старый диван и два кресла, около 25 кг"),
+    ] + [updates.photo(user_id, media_group_id=album) for _ in range(photos)]
+
+
+def admin_clicks(updates, user_id, order_ref):
+    # Кнопки несут номер заказа, который появляется только после оплаты,
+    # поэтому обновление собирается в момент отправки. None — заказа нет (слот был занят)
+    def click(action):
+        async def build():
+            ref = await order_ref(user_id)
+            return ref and updates.callback(ADMIN_ID, f"{action}_{ref}", chat_id=GROUP_CHAT_ID)
+        return build
+
+    return [click(action) for action in ("confirm", "pickedup", "dumped")]
+
+
+def order_lookup(db_path, wait):
+    # user_id -> номер заказа из orders.db; в режиме queue заказ записывается с задержкой
+    refs = {}
+    conn = None
+
+    async def order_ref(user_id):
+        nonlocal conn
+        if user_id in refs:
+            return refs[user_id]
+        deadline = time.monotonic() + wait
+        while True:
+            if conn is None and os.path.exists(db_path):
+                conn = sqlite3.connect(db_path)
+            row = conn and conn.execute("SELECT MAX(id) FROM orders WHERE user_id = ?", (user_id,)).fetchone()
+            if row and row[0] is not None:
+                refs[user_id] = encode_order_id(row[0])
+                return refs[user_id]
+            if time.monotonic() >= deadline:
+                refs[user_id] = None
+                return None
+            await asyncio.sleep(0.05)
+
+    return order_ref
+
+
+def scenario(users, large_share, seed, order_ref):
+    random.seed(seed)
+    updates = Updates()
+    date = (datetime.now(MOSCOW) + timedelta(days=1)).strftime("%d.%m.%Y")
+    slots = [f"{h}:00" for h in range(8, 21)]
+    streams = []
+    for i in range(users):
+        user_id = 10_000 + i
+        if random.random() < large_share:
+            streams.append(large_funnel(updates, user_id, photos=random.randint(2, 10)))
+        else:
+            streams.append(
+                order_funnel(updates, user_id, date, slots[i % len(slots)]) + admin_clicks(updates, user_id, order_ref)
+            )
+    return streams
+
+
+STREETS = [
+    "ул. Ленина", "пр-т Мира", "ул. Садовая", "Невский пр-т", "ул. Гагарина", "пер. Кривой",
+    "наб. реки Фонтанки", "ул. Пушкина", "б-р Победы", "ш. Энтузиастов", "ул. Лесная", "ул. Школьная",
+    # Улицы с числом в названии
+    "ул. 8 Марта", "2-я Тверская-Ямская ул.", "ул. 1905 года", "3-й Силикатный проезд",
+]
+
+
+def synthetic_address(rng):
+    house = f"{rng.randint(1, 120)}{rng.choice(['', '', '', 'а', 'б'])}"
+    if rng.random() < 0.2:
+        house += f"к{rng.randint(1, 4)}"
+    style = rng.random()
+    street = rng.choice(STREETS)
+    if style < 0.5:
+        return f"{street}, д. {house}, кв. {rng.randint(1, 300)}, подъезд {rng.randint(1, 8)}"
+    if style < 0.8:
+        return f"{street.split(' ', 1)[-1]} {house} кв {rng.randint(1, 300)}"
+    return f"{street} дом {house}, этаж {rng.randint(1, 16)}, код {rng.randint(100, 999)}"
+
+
+def manifest_benchmark(days, orders_per_day, seed):
+    # Маршрутные листы по синтетическим дням: время группировки и форматирования
+    from manifest import build_manifests, format_manifest
+
+    rng = random.Random(seed)
+    slots = [f"{h}:00" for h in range(8, 21)]
+    start = datetime(2030, 1, 1)
+    timings = []
+    messages = 0
+    for day in range(days):
+        date = (start + timedelta(days=day)).strftime("%d.%m.%Y")
+        orders = [
+            {
+                "id": i + 1,
+                "date": date,
+                "time_slot": rng.choice(slots),
+                "address": synthetic_address(rng),
+                "transfer": rng.choice(["Выставлен за дверь", "Курьер поднимется"]),
+            }
+            for i in range(orders_per_day)
+        ]
+        started = time.perf_counter()
+        for (slot_date, slot), groups in build_manifests(orders).items():
+            messages += len(format_manifest(slot_date, slot, groups))
+        timings.append(time.perf_counter() - started)
+    total = sum(timings)
+    return {
+        "days": days,
+        "orders_per_day": orders_per_day,
+        "orders_per_sec": round(days * orders_per_day / total, 1),
+        "day_p50_ms": round(percentile(timings, 0.50) * 1000, 3),
+        "day_p99_ms": round(percentile(timings, 0.99) * 1000, 3),
+        "messages": messages,
+    }
+
+
+def current_memory(traced):
+    # tracemalloc точнее, но заметно замедляет обработчики; по умолчанию смотрим на RSS
+    if traced:
+        return tracemalloc.get_traced_memory()[0]
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    async with ClientSession() as session:
+        while True:
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return
+            except OSError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Бот не ответил на {url} за {timeout} с")
+            await asyncio.sleep(0.2)
+
+
+async def stop_server(server, timeout=30.0):
+    if server.returncode is None:
+        server.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(server.wait(), timeout)
+            return
+        except asyncio.TimeoutError:
+            print(f"Бот не остановился за {timeout} с, завершаем принудительно", file=sys.stderr)
+    try:
+        os.killpg(server.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    await server.wait()
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="cleanbot-bench-")
+    stub_runner = None
+    stub_url = args.stub_url
+    if stub_url is None:
+        stub_runner = web.AppRunner(stub_api_app(args.api_latency))
+        await stub_runner.setup()
+        stub_site = web.TCPSite(stub_runner, "127.0.0.1", 0)
+        await stub_site.start()
+        stub_url = f"http://127.0.0.1:{stub_site._server.sockets[0].getsockname()[1]}"
+
+    os.environ.update(
+        TOKEN="123456:bench",
+        BOT_API_URL=stub_url,
+        WEBHOOK_URL="https://example.invalid/webhook",
+        GROUP_CHAT_ID=str(GROUP_CHAT_ID),
+        ORDERS_DB=os.path.join(workdir, "orders.db"),
+        ORDERS_CSV=os.path.join(workdir, "orders.csv"),
+        FSM_DB=os.path.join(workdir, "fsm.db"),
+        FSM_STORAGE=args.storage,
+        WEBHOOK_MODE=args.mode,
+    )
+    if not args.real_limits:
+        os.environ.update(
+            OUTBOX_GLOBAL_RATE="100000", OUTBOX_PRIVATE_RATE="100000", OUTBOX_GROUP_RATE="100000", THROTTLE="0"
+        )
+
+    # Сырые длительности обработчиков для точных перцентилей (только в одном процессе)
+    handler_times = []
+    server = bot = bot_runner = None
+    if args.workers > 1:
+        # Несколько процессов на общем порту: bot.py запускается как в продакшене
+        port = free_port()
+        os.environ.update(WORKERS=str(args.workers), PORT=str(port), LEADER_LOCK=os.path.join(workdir, "leader.lock"))
+        # Своя группа процессов: при зависании останавливаем и главный процесс, и workers
+        server = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py"),
+            stdout=subprocess.DEVNULL, start_new_session=True,
+        )
+        try:
+            await wait_ready(f"http://127.0.0.1:{port}/metrics")
+        except Exception:
+            await stop_server(server, timeout=0)
+            raise
+        webhook = f"http://127.0.0.1:{port}/webhook"
+    else:
+        import bot  # импорт после настройки окружения
+
+        async def timing(handler, event, data):
+            started = time.perf_counter()
+            try:
+                return await handler(event, data)
+            finally:
+                handler_times.append(time.perf_counter() - started)
+
+        bot.dp.message.middleware(timing)
+        bot.dp.callback_query.middleware(timing)
+
+        bot_runner = web.AppRunner(bot.app)
+        await bot_runner.setup()
+        bot_site = web.TCPSite(bot_runner, "127.0.0.1", 0)
+        await bot_site.start()
+        webhook = f"http://127.0.0.1:{bot_site._server.sockets[0].getsockname()[1]}/webhook"
+
+    # В режиме queue заказ записывается уже после ответа вебхука, поэтому кнопки админа
+    # отправляются вторым этапом, когда очередь разобрана (или с ожиданием, если бот в другом процессе)
+    two_phase = args.mode == "queue" and bot is not None
+    order_ref = order_lookup(os.environ["ORDERS_DB"], wait=5.0 if args.mode == "queue" and not two_phase else 0.0)
+    streams = scenario(args.users, args.large_share, args.seed, order_ref)
+    phases = [streams]
+    if two_phase:
+        phases = [
+            [[update for update in stream if not callable(update)] for stream in streams],
+            [[update for update in stream if callable(update)] for stream in streams],
+        ]
+    total = 0
+    request_times = []
+    rejected = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def drive(session, stream):
+        nonlocal rejected, total
+        async with semaphore:
+            for update in stream:
+                if callable(update):
+                    update = await update()
+                    if update is None:
+                        continue
+                total += 1
+                while True:
+                    started = time.perf_counter()
+                    async with session.post(webhook, json=update) as response:
+                        await response.read()
+                    request_times.append(time.perf_counter() - started)
+                    if response.status != 503:
+                        break
+                    rejected += 1
+                    await asyncio.sleep(0.05)
+
+    if args.trace_memory:
+        tracemalloc.start()
+    memory_before = current_memory(args.trace_memory)
+    started = time.perf_counter()
+    async with ClientSession() as session:
+        for phase in phases:
+            await asyncio.gather(*(drive(session, stream) for stream in phase))
+            if args.mode == "queue" and bot is not None:
+                await bot.update_queue.join()
+    elapsed = time.perf_counter() - started
+    memory_after = current_memory(args.trace_memory)
+    if args.trace_memory:
+        tracemalloc.stop()
+
+    if server is not None:
+        # Ждём асинхронно: остановке бота может понадобиться заглушка Bot API из этого же loop
+        await stop_server(server)
+    else:
+        await bot_runner.cleanup()
+    calls = None
+    if stub_runner is not None:
+        calls = stub_runner.app["calls"]["count"]
+        await stub_runner.cleanup()
+
+    return {
+        "storage": args.storage,
+        "mode": args.mode,
+        "workers": args.workers,
+        "users": args.users,
+        "updates": total,
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(total / elapsed, 1),
+        "handler_p50_ms": round(percentile(handler_times, 0.50) * 1000, 3) if handler_times else None,
+        "handler_p99_ms": round(percentile(handler_times, 0.99) * 1000, 3) if handler_times else None,
+        "request_p50_ms": round(percentile(request_times, 0.50) * 1000, 3),
+        "request_p99_ms": round(percentile(request_times, 0.99) * 1000, 3),
+        "rejected": rejected,
+        "api_calls": calls,
+        "memory_growth_kb": round((memory_after - memory_before) / 1024, 1),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def compare(args):
+    # Каждая конфигурация — в отдельном процессе, потому что bot.py читает окружение при импорте
+    results = []
+    for storage, mode in itertools.product(("memory", "sqlite"), ("inline", "queue")):
+        command = [
+            sys.executable, __file__, "--json",
+            "--storage", storage, "--mode", mode,
+            "--users", str(args.users), "--concurrency", str(args.concurrency),
+            "--large-share", str(args.large_share), "--seed", str(args.seed),
+            "--api-latency", str(args.api_latency),
+        ]
+        if args.stub_url:
+            command += ["--stub-url", args.stub_url]
+        if args.real_limits:
+            command.append("--real-limits")
+        if args.trace_memory:
+            command.append("--trace-memory")
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def print_table(results):
+    columns = [
+        "storage", "mode", "workers", "updates", "updates_per_sec", "handler_p50_ms", "handler_p99_ms",
+        "request_p50_ms", "request_p99_ms", "rejected", "memory_growth_kb",
+    ]
+    widths = [max(len(column), *(len(str(result[column])) for result in results)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for result in results:
+        print("  ".join(str(result[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест вебхука бота")
+    parser.add_argument("--users", type=int, default=200, help="число синтетических клиентов")
+    parser.add_argument("--concurrency", type=int, default=50, help="одновременно активных клиентов")
+    parser.add_argument("--large-share", type=float, default=0.1, help="доля заявок на крупный мусор")
+    parser.add_argument("--storage", choices=("memory", "sqlite"), default="sqlite")
+    parser.add_argument("--mode", choices=("inline", "queue"), default="inline")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка заглушки Bot API, с")
+    parser.add_argument("--workers", type=int, default=1, help="процессов бота (WORKERS), >1 — отдельный процесс")
+    parser.add_argument("--real-limits", action="store_true", help="не снимать лимиты исходящих сообщений и частоты")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--trace-memory", action="store_true", help="считать прирост памяти через tracemalloc")
+    parser.add_argument("--manifest", action="store_true", help="замерить построение маршрутных листов")
+    parser.add_argument("--days", type=int, default=30, help="дней для --manifest")
+    parser.add_argument("--orders-per-day", type=int, default=5000, help="заявок в день для --manifest")
+    parser.add_argument("--stub-url", help="адрес уже запущенной заглушки Bot API")
+    parser.add_argument("--serve-stub", type=int, metavar="PORT", help="только запустить заглушку Bot API")
+    parser.add_argument("--compare", action="store_true", help="сравнить все хранилища и режимы")
+    parser.add_argument("--json", action="store_true", help="вывести результат одной строкой JSON")
+    args = parser.parse_args()
+
+    if args.manifest:
+        result = manifest_benchmark(args.days, args.orders_per_day, args.seed)
+        print(json.dumps(result) if args.json else "  ".join(f"{key}={value}" for key, value in result.items()))
+        return
+
+    if args.serve_stub:
+        web.run_app(stub_api_app(args.api_latency), host="127.0.0.1", port=args.serve_stub)
+        return
+
+    if args.compare:
+        print_table(compare(args))
+        return
+
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print_table([result])
+        print(f"api_calls={result['api_calls']} max_rss_mb={result['max_rss_mb']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,13 @@
 
 import asyncio
 import os
-import csv
+from functools import lru_cache
 from datetime import datetime, timedelta
 import pytz
 from aiohttp import web
 from aiogram import Bot, Dispatcher, F, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
 from aiogram.enums import ParseMode
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.state import State, StatesGroup
@@ -14,14 +16,112 @@ from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.filters import Command
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from analytics import export as export_analytics
+from cluster import LeaderLease, SharedAlbums, SharedDedup, serve_workers
+from fsm_storage import SQLiteStorage
+from manifest import format_manifest, group_by_address
+from metrics import HandlerMetricsMiddleware, InstrumentedStorage, RequestMetricsMiddleware, registry
+from outbox import ADMIN, Outbox
+from scheduler import Scheduler
+from orders import OPEN_STATUSES, PRODUCTS, OrderStore, ReservationBook, SlotIndex, decode_order_id, encode_order_id
+from throttling import ThrottlingMiddleware
+from updates import AlbumCollector, UpdateQueue
+
 TOKEN = os.getenv("TOKEN")
+BOT_API_URL = os.getenv("BOT_API_URL")  # свой сервер Bot API (локальный или заглушка для нагрузочных тестов)
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
 GROUP_CHAT_ID = int(os.getenv("GROUP_CHAT_ID", "0"))
 PHONE_NUMBER = os.getenv("PHONE_NUMBER", "0000000000")
 BANK_NAME = os.getenv("BANK_NAME", "Тинькофф")
-
-bot = Bot(token=TOKEN, parse_mode=ParseMode.HTML)
-dp = Dispatcher(storage=MemoryStorage())
+ORDERS_CSV = os.getenv("ORDERS_CSV", "orders.csv")
+ORDERS_DB = os.getenv("ORDERS_DB", "orders.db")
+RESERVATION_TTL = int(os.getenv("RESERVATION_TTL", "900"))
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")  # sqlite | memory
+FSM_DB = os.getenv("FSM_DB", "fsm.db")
+MOSCOW = pytz.timezone("Europe/Moscow")
+SLOW_UPDATE_SECONDS = float(os.getenv("SLOW_UPDATE_SECONDS", "1.0"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))
+OUTBOX_PRIVATE_RATE = float(os.getenv("OUTBOX_PRIVATE_RATE", "1"))
+OUTBOX_GROUP_RATE = float(os.getenv("OUTBOX_GROUP_RATE", str(20 / 60)))
+ALBUM_WINDOW = float(os.getenv("ALBUM_WINDOW", "0.5"))
+MANIFEST_LEAD_MINUTES = int(os.getenv("MANIFEST_LEAD_MINUTES", "30"))
+SLOT_HOURS = range(8, 21)
+JOBS_DB = os.getenv("JOBS_DB", ORDERS_DB)
+REMINDER_HOUR = int(os.getenv("REMINDER_HOUR", "20"))  # напоминание накануне, по Москве
+FSM_DRAFT_TTL = int(os.getenv("FSM_DRAFT_TTL", str(7 * 24 * 3600)))
+WORKERS = int(os.getenv("WORKERS", "1"))  # процессов на одном порту
+LEADER_LOCK = os.getenv("LEADER_LOCK", "bot.leader.lock")
+THROTTLE = os.getenv("THROTTLE", "1") == "1"  # ограничение частоты на пользователя
+ANALYTICS_DIR = os.getenv("ANALYTICS_DIR")  # ночная выгрузка для analytics.py, если задан
+
+api_server = TelegramAPIServer.from_base(BOT_API_URL) if BOT_API_URL else PRODUCTION
+bot = Bot(token=TOKEN, session=AiohttpSession(api=api_server), parse_mode=ParseMode.HTML)
+# 🧵 При WORKERS > 1 состояние общее для всех процессов: FSM пишется в базу сразу
+# и без кэша, брони проверяются транзакцией в базе, лимиты отправки делятся поровну
+SHARED = WORKERS > 1
+if SHARED and FSM_STORAGE != "sqlite":
+    raise RuntimeError("WORKERS > 1 требует FSM_STORAGE=sqlite: состояние должно быть общим для процессов")
+if FSM_STORAGE == "sqlite":
+    storage = SQLiteStorage(FSM_DB, flush_interval=None, cache=False) if SHARED else SQLiteStorage(FSM_DB)
+else:
+    storage = MemoryStorage()
+dp = Dispatcher(storage=InstrumentedStorage(storage))
+order_store = OrderStore(ORDERS_DB)
+slot_index = SlotIndex()
+reservations = ReservationBook(order_store, slot_index, ttl=RESERVATION_TTL, shared=SHARED)
+scheduler = Scheduler(JOBS_DB)
+# Фото одного альбома при WORKERS > 1 попадают в разные процессы — копим их в общей базе
+albums = SharedAlbums(ORDERS_DB, window=ALBUM_WINDOW) if SHARED else AlbumCollector(window=ALBUM_WINDOW)
+outbox = Outbox(
+    global_rate=OUTBOX_GLOBAL_RATE / WORKERS,
+    private_rate=OUTBOX_PRIVATE_RATE,
+    group_rate=OUTBOX_GROUP_RATE / WORKERS,
+)
+lease = LeaderLease(LEADER_LOCK)
+dedup = SharedDedup(ORDERS_DB) if SHARED else None
+
+# 🚦 Ограничение частоты: (токенов в секунду, запас) на пользователя для каждого класса
+THROTTLE_LIMITS = {
+    "order": (1 / 5, 3),       # новая заявка и /start — не чаще раза в 5 секунд после трёх подряд
+    "navigation": (2, 6),      # кнопки воронки: услуга, способ, дата, время, «Назад»
+    "photo": (1, 10),          # фото и чеки — альбом до 10 снимков проходит целиком
+    "default": (1, 5),         # остальные сообщения и кнопки
+    "admin": None,             # кнопки админ-группы не ограничиваем
+}
+THROTTLE_CLASSES = {
+    "start": "order",
+    "new_order": "order",
+    "show_instruction": "navigation",
+    "back_to_start": "navigation",
+    "choose_product": "navigation",
+    "choose_transfer": "navigation",
+    "back_to_product": "navigation",
+    "choose_date": "navigation",
+    "choose_time": "navigation",
+    "photo_step": "photo",
+    "process_payment_proof": "photo",
+    "confirm_payment": "admin",
+    "picked_up": "admin",
+    "dumped": "admin",
+}
+if THROTTLE:
+    # Раньше метрик: отброшенные обновления не искажают время обработчиков
+    throttling = ThrottlingMiddleware(THROTTLE_LIMITS, THROTTLE_CLASSES)
+    dp.message.middleware(throttling)
+    dp.callback_query.middleware(throttling)
+    registry.gauge("bot_throttle", "Пользователи под ограничением частоты", throttling.stats)
+
+# 📈 Метрики: время обработчиков, запросов к Bot API и операций FSM
+handler_metrics = HandlerMetricsMiddleware(slow_threshold=SLOW_UPDATE_SECONDS, profile_rate=PROFILE_SAMPLE_RATE)
+dp.message.middleware(handler_metrics)
+dp.callback_query.middleware(handler_metrics)
+bot.session.middleware(RequestMetricsMiddleware())
+registry.gauge("bot_update_queue", "Очередь входящих обновлений", lambda: update_queue.stats())
+registry.gauge("bot_outbox", "Очередь исходящих сообщений", lambda: outbox.stats())
+
+def now_msk():
+    return datetime.now(MOSCOW)
 
 class OrderStates(StatesGroup):
     waiting_for_product = State()
@@ -35,77 +135,121 @@ class OrderStates(StatesGroup):
     waiting_for_large_photos = State()
 
 
-products = {
-    "🧺 Один пакет мусора": 100,
-    "🗑️ 2–3 пакета мусора": 200,
-    "🛢 Крупный мусор": 500
+# Пояснения к названию услуги на кнопке
+product_notes = {
+    "🛢 Крупный мусор": " (до 30 кг)"
 }
 
-@dp.message(Command("start"))
-async def start(message: Message, state: FSMContext):
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="📝 Оставить заявку", callback_data="new_order")],
-            [InlineKeyboardButton(text="📄 Показать инструкцию", callback_data="show_instruction")],
-            [InlineKeyboardButton(text="📞 Связаться с администратором", url="https://t.me/danya1088")]
+# 🧩 Клавиатуры и тексты, которые не меняются, собираются один раз при импорте
+START_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="📝 Оставить заявку", callback_data="new_order")],
+        [InlineKeyboardButton(text="📄 Показать инструкцию", callback_data="show_instruction")],
+        [InlineKeyboardButton(text="📞 Связаться с администратором", url="https://t.me/danya1088")]
+    ]
+)
+
+RESTART_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="📝 Оставить заявку", callback_data="new_order")],
+        [InlineKeyboardButton(text="📄 Показать инструкцию", callback_data="show_instruction")]
+    ]
+)
+
+CONTINUE_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Продолжить", callback_data="new_order")]
+    ]
+)
+
+PRODUCT_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(
+            text=f"{name}{product_notes.get(name, '')} — {price} ₽", callback_data=f"product_{name}"
+        )]
+        for name, price in PRODUCTS.items()
+    ] + [[InlineKeyboardButton(text="⬅ Назад", callback_data="back_to_start")]]
+)
+
+TRANSFER_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(text="✅ Выставить за дверь", callback_data="transfer_door"),
+            InlineKeyboardButton(text="🚪 Курьер поднимется", callback_data="transfer_up")
         ]
-    )
-    await message.answer("📍 Добро пожаловать в сервис уборки мусора!")
+    ]
+)
 
-    await message.answer("Выберите действие:", reply_markup=keyboard)
-    await state.clear()
+# Цены в инструкции — те же, что на кнопках выбора услуги
+PRICE_LINES = "".join(f"    • {name}{product_notes.get(name, '')} — {price} ₽\n" for name, price in PRODUCTS.items())
+INSTRUCTION_TEXT = (
+    "🚀 Как мы работаем:\n\n"
+    "1️⃣ Вы оставляете заявку через наш бот:\n"
+    "- Нажимаете кнопку '📝 Оставить заявку'.\n"
+    "- Выбираете тип мусора:\n"
+    f"{PRICE_LINES}"
+    "2️⃣ Вы выбираете способ передачи мусора:\n"
+    "- ✅ Мусор выставлен за дверь — курьер просто заберёт его.\n"
+    "- 🚪 Курьер поднимется и заберёт лично — клиент должен быть дома.\n\n"
+    "3️⃣ Вы выбираете дату выполнения заявки:\n"
+    "- ✅ Сегодня — курьер заберёт мусор в ближайшее время.\n"
+    "- 📅 Завтра — заявка будет выполнена на следующий день.\n\n"
+    "4️⃣ Указываете точный адрес:\n"
+    "- Улица, дом, корпус, подъезд, этаж, квартира, код от домофона.\n\n"
+    "5️⃣ Отправляете фото мусора:\n"
+    "- Фото обязательно для любого типа мусора.\n"
+    "- Общий вес крупного мусора — до 30 кг.\n"
+    "- Для крупного мусора обязательна связь с администратором.\n\n"
+    "6️⃣ Оплачиваете услугу:\n"
+    "- Мы укажем номер телефона для перевода.\n"
+    "- После перевода отправьте фото чека.\n\n"
+    "7️⃣ Курьер забирает и выбрасывает мусор:\n"
+    "- Курьер заберёт мусор в указанное время.\n"
+    "- Вы получите уведомления: ✅ 'Мусор забран.' и 🚮 'Мусор выброшен.'"
+)
 
-@dp.callback_query(F.data == "show_instruction")
-async def show_instruction(callback: CallbackQuery):
-    instruction_text = (
-        "🚀 Как мы работаем:\n\n"
-        "1️⃣ Вы оставляете заявку через наш бот:\n"
-        "- Нажимаете кнопку '📝 Оставить заявку'.\n"
-        "- Выбираете тип мусора:\n"
-        "    • 🧺 Один пакет — 100 ₽\n"
-        "    • 🗑️ 2–3 пакета — 200 ₽\n"
-        "    • 🛢 Крупный мусор (до 30 кг) — 500 ₽\n"
-        "2️⃣ Вы выбираете способ передачи мусора:\n"
-        "- ✅ Мусор выставлен за дверь — курьер просто заберёт его.\n"
-        "- 🚪 Курьер поднимется и заберёт лично — клиент должен быть дома.\n\n"
-        "3️⃣ Вы выбираете дату выполнения заявки:\n"
-        "- ✅ Сегодня — курьер заберёт мусор в ближайшее время.\n"
-        "- 📅 Завтра — заявка будет выполнена на следующий день.\n\n"
-        "4️⃣ Указываете точный адрес:\n"
-        "- Улица, дом, корпус, подъезд, этаж, квартира, код от домофона.\n\n"
-        "5️⃣ Отправляете фото мусора:\n"
-        "- Фото обязательно для любого типа мусора.\n"
-        "- Общий вес крупного мусора — до 30 кг.\n"
-        "- Для крупного мусора обязательна связь с администратором.\n\n"
-        "6️⃣ Оплачиваете услугу:\n"
-        "- Мы укажем номер телефона для перевода.\n"
-        "- После перевода отправьте фото чека.\n\n"
-        "7️⃣ Курьер забирает и выбрасывает мусор:\n"
-        "- Курьер заберёт мусор в указанное время.\n"
-        "- Вы получите уведомления: ✅ 'Мусор забран.' и 🚮 'Мусор выброшен.'"
+# 📅 Клавиатура дат зависит только от текущего дня — пересобирается при смене даты
+@lru_cache(maxsize=2)
+def _date_keyboard(today):
+    tomorrow = (datetime.strptime(today, "%d.%m.%Y") + timedelta(days=1)).strftime("%d.%m.%Y")
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text=f"✅ Сегодня ({today})", callback_data=f"date_{today}")],
+            [InlineKeyboardButton(text=f"📅 Завтра ({tomorrow})", callback_data=f"date_{tomorrow}")],
+            [InlineKeyboardButton(text="⬅ Назад", callback_data="back_to_product")]
+        ]
     )
 
-    continue_keyboard = InlineKeyboardMarkup(
+def date_keyboard():
+    return _date_keyboard(now_msk().strftime("%d.%m.%Y"))
+
+# 🕐 Клавиатура времени кэшируется по набору свободных слотов:
+# любое изменение занятости или наступивший час дают новый ключ
+@lru_cache(maxsize=256)
+def slot_keyboard(available_slots):
+    return InlineKeyboardMarkup(
         inline_keyboard=[
-            [InlineKeyboardButton(text="✅ Продолжить", callback_data="new_order")]
+            [InlineKeyboardButton(text=slot, callback_data=f"time_{slot}")] for slot in available_slots
         ]
     )
 
-    await callback.message.answer(instruction_text, reply_markup=continue_keyboard)
+@dp.message(Command("start"))
+async def start(message: Message, state: FSMContext):
+    await message.answer("📍 Добро пожаловать в сервис уборки мусора!")
+
+    await message.answer("Выберите действие:", reply_markup=START_KEYBOARD)
+    await state.clear()
+
+@dp.callback_query(F.data == "show_instruction")
+async def show_instruction(callback: CallbackQuery):
+    await callback.message.answer(INSTRUCTION_TEXT, reply_markup=CONTINUE_KEYBOARD)
     await callback.answer()
 
 @dp.callback_query(F.data == "new_order")
 async def new_order(callback: CallbackQuery, state: FSMContext):
     await state.clear()
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="🧺 Один пакет мусора — 100 ₽", callback_data="product_🧺 Один пакет мусора")],
-            [InlineKeyboardButton(text="🗑️ 2–3 пакета мусора — 200 ₽", callback_data="product_🗑️ 2–3 пакета мусора")],
-            [InlineKeyboardButton(text="🛢 Крупный мусор (до 30 кг) — 500 ₽", callback_data="product_🛢 Крупный мусор")],
-            [InlineKeyboardButton(text="⬅ Назад", callback_data="back_to_start")]
-        ]
-    )
-    await callback.message.answer("Выберите тип мусора:", reply_markup=keyboard)
+    await reservations.release(callback.from_user.id)
+    await callback.message.answer("Выберите тип мусора:", reply_markup=PRODUCT_KEYBOARD)
     await callback.answer()
 
 @dp.callback_query(F.data == "back_to_start")
@@ -113,12 +257,7 @@ async def back_to_start(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.answer(
         "📋 Для оформления новой заявки нажмите кнопку:",
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [InlineKeyboardButton(text="📝 Оставить заявку", callback_data="new_order")],
-                [InlineKeyboardButton(text="📄 Показать инструкцию", callback_data="show_instruction")]
-            ]
-        )
+        reply_markup=RESTART_KEYBOARD
     )
     await callback.answer()
 
@@ -135,16 +274,7 @@ async def choose_product(callback: CallbackQuery, state: FSMContext):
     # Все остальные продукты — обычный порядок
     await state.update_data(product=product)
 
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text="✅ Выставить за дверь", callback_data="transfer_door"),
-                InlineKeyboardButton(text="🚪 Курьер поднимется", callback_data="transfer_up")
-            ]
-        ]
-    )
-
-    await callback.message.answer("Выберите способ передачи мусора:", reply_markup=keyboard)
+    await callback.message.answer("Выберите способ передачи мусора:", reply_markup=TRANSFER_KEYBOARD)
     await state.set_state(OrderStates.waiting_for_transfer)
 
 @dp.message(OrderStates.waiting_for_large_description)
@@ -164,37 +294,19 @@ async def choose_transfer(callback: CallbackQuery, state: FSMContext):
     await state.update_data(transfer=transfer_method, contact_method=transfer_method)
     await callback.answer()
 
-    today = datetime.now().strftime("%d.%m.%Y")
-    tomorrow = (datetime.now() + timedelta(days=1)).strftime("%d.%m.%Y")
-
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text=f"✅ Сегодня ({today})", callback_data=f"date_{today}")],
-            [InlineKeyboardButton(text=f"📅 Завтра ({tomorrow})", callback_data=f"date_{tomorrow}")],
-            [InlineKeyboardButton(text="⬅ Назад", callback_data="back_to_product")]
-        ]
-    )
-
-    await callback.message.answer("Выберите дату выполнения заявки:", reply_markup=keyboard)
+    await callback.message.answer("Выберите дату выполнения заявки:", reply_markup=date_keyboard())
     await state.set_state(OrderStates.waiting_for_date)
 
 @dp.callback_query(F.data == "back_to_product")
 async def back_to_product(callback: CallbackQuery, state: FSMContext):
     await callback.message.answer(
         "Выберите тип мусора:",
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [InlineKeyboardButton(text="🧺 Один пакет мусора — 100 ₽", callback_data="product_🧺 Один пакет мусора")],
-                [InlineKeyboardButton(text="🗑️ 2–3 пакета мусора — 200 ₽", callback_data="product_🗑️ 2–3 пакета мусора")],
-                [InlineKeyboardButton(text="🛢 Крупный мусор (до 30 кг) — 500 ₽", callback_data="product_🛢 Крупный мусор")],
-                [InlineKeyboardButton(text="⬅ Назад", callback_data="back_to_start")]
-            ]
-        )
+        reply_markup=PRODUCT_KEYBOARD
     )
     await callback.answer()
 
     # 🔵 А уже потом отправляем сообщение
-    await callback.message.answer("Выберите дату выполнения заявки:", reply_markup=keyboard)
+    await callback.message.answer("Выберите дату выполнения заявки:", reply_markup=date_keyboard())
     await state.set_state(OrderStates.waiting_for_date)
 
 @dp.callback_query(F.data.startswith("date_"))
@@ -202,61 +314,41 @@ async def choose_date(callback: CallbackQuery, state: FSMContext):
     chosen_date = callback.data.split("_", 1)[1]
     await state.update_data(date=chosen_date)
 
-    now = datetime.now(pytz.timezone("Europe/Moscow"))
+    now = now_msk()
     today = now.strftime("%d.%m.%Y")
 
     if chosen_date == today:
-        current_hour = now.hour
-        time_slots = [f"{h}:00" for h in range(max(8, current_hour + 1), 21)]
+        # Маршрут слота уходит курьеру за MANIFEST_LEAD_MINUTES до начала —
+        # слоты, маршрут которых уже отправлен, не предлагаем
+        cutoff = now + timedelta(minutes=MANIFEST_LEAD_MINUTES)
+        time_slots = [f"{h}:00" for h in SLOT_HOURS if now.replace(hour=h, minute=0, second=0, microsecond=0) > cutoff]
     else:
-        time_slots = [f"{h}:00" for h in range(8, 21)]
+        time_slots = [f"{h}:00" for h in SLOT_HOURS]
 
-    slot_counts = {slot: 0 for slot in time_slots}
-    try:
-        with open("orders.csv", "r", encoding="utf-8") as f:
-            rows = list(csv.reader(f))
-            for row in rows[1:]:
-                if row and row[4] in slot_counts and row[3] == chosen_date:
-                    slot_counts[row[4]] += 1
-    except FileNotFoundError:
-        pass
-
-    available_slots = [slot for slot, count in slot_counts.items() if count < 15]
+    available_slots = await reservations.available(chosen_date, time_slots)
     if not available_slots:
         await callback.message.answer(f"❌ Все временные интервалы на {chosen_date} заняты. Попробуйте другую дату.")
         await state.clear()
         return
 
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text=slot, callback_data=f"time_{slot}")] for slot in available_slots
-        ]
-    )
-    await callback.message.answer("🕐 Выберите удобное время уборки:", reply_markup=keyboard)
+    await callback.message.answer("🕐 Выберите удобное время уборки:", reply_markup=slot_keyboard(tuple(available_slots)))
     await state.set_state(OrderStates.waiting_for_time)
 
 @dp.callback_query(F.data.startswith("time_"))
 async def choose_time(callback: CallbackQuery, state: FSMContext):
     time_chosen = callback.data.split("_", 1)[1]
+    data = await state.get_data()
+
+    # 🔒 Бронируем место в слоте сразу при выборе времени
+    if not await reservations.reserve(callback.from_user.id, data.get("date"), time_chosen):
+        await callback.answer("❌ Это время уже занято. Выберите другое.", show_alert=True)
+        return
+
     await state.update_data(time_slot=time_chosen)
     await callback.message.answer("📍 Укажите точный адрес (улица, дом, подъезд, этаж, код, квартира):")
     await state.set_state(OrderStates.waiting_for_address)
     await callback.answer()
 
-from datetime import datetime, timedelta
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-
-today = datetime.now().strftime("%d.%m.%Y")
-tomorrow = (datetime.now() + timedelta(days=1)).strftime("%d.%m.%Y")
-
-keyboard = InlineKeyboardMarkup(
-    inline_keyboard=[
-        [InlineKeyboardButton(text=f"✅ Сегодня ({today})", callback_data=f"date_{today}")],
-        [InlineKeyboardButton(text=f"📅 Завтра ({tomorrow})", callback_data=f"date_{tomorrow}")],
-        [InlineKeyboardButton(text="⬅ Назад", callback_data="back_to_product")]
-    ]
-)
-
 @dp.message(OrderStates.waiting_for_address)
 async def get_address(message: Message, state: FSMContext):
     address = message.text.strip()
@@ -275,21 +367,33 @@ async def photo_step(message: Message, state: FSMContext):
         await message.answer("❗ Пожалуйста, отправьте как минимум 2 фото мусора.")
         return
 
+    photo_id = message.photo[-1].file_id
+
+    # Альбом приходит отдельными обновлениями — собираем его и обрабатываем один раз
+    if message.media_group_id:
+        albums.add(
+            (message.chat.id, message.media_group_id),
+            photo_id,
+            lambda photo_ids: accept_photos(message, state, photo_ids),
+        )
+        return
+
+    await accept_photos(message, state, [photo_id])
+
+async def accept_photos(message: Message, state: FSMContext, photo_ids):
     data = await state.get_data()
     product = data.get("product")
-    photos = data.get("photos", [])
 
-    if not product or product not in products:
+    if not product or product not in PRODUCTS:
         await message.answer("❗ Ошибка: не удалось определить услугу. Пожалуйста, начните заявку заново.")
         await state.clear()
         return
 
-    # Добавляем новое фото
-    photo_id = message.photo[-1].file_id
-    photos.append(photo_id)
-    await state.update_data(photos=photos)
+    # Добавляем новые фото
+    photos = data.get("photos", []) + photo_ids
 
     if product == "🛢 Крупный мусор":
+        await state.update_data(photos=photos)
         if len(photos) < 2:
             await message.answer(f"📷 Получено {len(photos)} фото. Добавьте ещё минимум {2 - len(photos)}.")
             return
@@ -306,17 +410,17 @@ async def photo_step(message: Message, state: FSMContext):
         if media:
             media[0].caption = caption
             media[0].parse_mode = "HTML"
-            await bot.send_media_group(chat_id=GROUP_CHAT_ID, media=media)
+            outbox.post(GROUP_CHAT_ID, lambda: bot.send_media_group(chat_id=GROUP_CHAT_ID, media=media))
         else:
-            await bot.send_message(GROUP_CHAT_ID, caption, parse_mode="HTML")
+            outbox.post(GROUP_CHAT_ID, lambda: bot.send_message(GROUP_CHAT_ID, caption, parse_mode="HTML"))
 
         await message.answer("📨 Заявка отправлена администратору. Ожидайте связи.")
         await state.clear()
         return
 
     # обычный порядок
-    price = products[product]
-    await state.update_data(price=price)
+    price = PRODUCTS[product]
+    await state.update_data(photos=photos, price=price)
 
     await message.answer(
         f"💳 Оплата: <b>{price} ₽</b>\n"
@@ -342,8 +446,26 @@ async def process_payment_proof(message: Message, state: FSMContext):
         username = message.from_user.username or message.from_user.full_name
         user_id = message.from_user.id
 
+        # 💾 Сохраняем заказ и сразу учитываем его в занятости слота.
+        # Если пост в админ-группу не ушёл и клиент прислал чек повторно, заказ уже есть
+        order_id = data.get("order_id")
+        if order_id is None:
+            order_id = await reservations.book(user_id, {
+                "user_id": user_id,
+                "username": username,
+                "product": product,
+                "date": date,
+                "time_slot": time,
+                "address": address,
+                "transfer": transfer,
+                "price": price,
+            })
+            await state.update_data(order_id=order_id)
+            await schedule_reminder(order_id, user_id, date, time)
+        order_ref = encode_order_id(order_id)
+
         caption = (
-            f"📦 Новая заявка\n"
+            f"📦 Новая заявка <code>{order_ref}</code>\n"
             f"👤 Пользователь: @{username}\n"
             f"🆔 Telegram ID: <code>{user_id}</code>\n"
             f"🧾 Услуга: {product}\n"
@@ -356,11 +478,16 @@ async def process_payment_proof(message: Message, state: FSMContext):
 
         confirm_keyboard = InlineKeyboardMarkup(
             inline_keyboard=[
-                [InlineKeyboardButton(text="✅ Подтвердить оплату", callback_data=f"confirm_{user_id}")]
+                [InlineKeyboardButton(text="✅ Подтвердить оплату", callback_data=f"confirm_{order_ref}")]
             ]
         )
 
-        await bot.send_photo(chat_id=GROUP_CHAT_ID, photo=receipt_photo, caption=caption, reply_markup=confirm_keyboard)
+        # Ждём отправки: без этого поста заявку некому подтвердить
+        await outbox.send(
+            GROUP_CHAT_ID,
+            lambda: bot.send_photo(chat_id=GROUP_CHAT_ID, photo=receipt_photo, caption=caption, reply_markup=confirm_keyboard),
+            priority=ADMIN,
+        )
         await message.answer("✅ Чек получен. Ожидайте подтверждения от администратора.")
         await state.clear()
 
@@ -371,53 +498,302 @@ async def process_payment_proof(message: Message, state: FSMContext):
 # 📌 Настройки Webhook
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
 PORT = int(os.environ.get("PORT", 10000))
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "inline")  # inline | queue
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+
+async def process_update(update):
+    await dp.feed_update(bot, update)
+
+update_queue = UpdateQueue(process_update, workers=UPDATE_WORKERS, maxsize=UPDATE_QUEUE_SIZE)
 
 # 📩 Обработка входящих запросов от Telegram
 async def webhook_handler(request):
     data = await request.json()
     update = types.Update(**data)
-    await dp.feed_update(bot, update)
+    # update_id отмечается до обработки, чтобы два процесса не взяли один повтор одновременно.
+    # Если обновление не принято, отметка снимается и повтор Telegram будет обработан
+    if dedup is not None and await dedup.seen(update.update_id):
+        # Повтор от Telegram, уже принятый другим процессом
+        return web.Response()
+    if WEBHOOK_MODE == "queue":
+        # Отвечаем сразу, обработка идёт в фоне. При переполнении Telegram повторит запрос позже
+        if not update_queue.put(update):
+            if dedup is not None:
+                await dedup.forget(update.update_id)
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        return web.Response()
+    try:
+        await dp.feed_update(bot, update)
+    except Exception:
+        if dedup is not None:
+            await dedup.forget(update.update_id)
+        raise
     return web.Response()
 
+# 📈 Состояние очереди обновлений
+async def queue_stats(request):
+    return web.json_response(update_queue.stats())
+
+# 📈 Метрики в формате Prometheus
+async def metrics_handler(request):
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+# ⏰ Фоновые задачи. Всё время считается по Москве
+def daily_at(hour, minute=0):
+    def next_run(now):
+        now = now.astimezone(MOSCOW)
+        run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        return run if run > now else run + timedelta(days=1)
+    return next_run
+
+def every(seconds):
+    return lambda now: now + timedelta(seconds=seconds)
+
+def next_manifest_run(now):
+    # За MANIFEST_LEAD_MINUTES до начала ближайшего слота
+    now = now.astimezone(MOSCOW)
+    lead = timedelta(minutes=MANIFEST_LEAD_MINUTES)
+    today = now.replace(minute=0, second=0, microsecond=0)
+    starts = (today.replace(hour=h) + timedelta(days=days) for days in (0, 1) for h in SLOT_HOURS)
+    return min(start for start in starts if start - lead > now) - lead
+
+# ⏳ Снимаем брони брошенных заявок
+async def expire_reservations_job(job):
+    await reservations.expire()
+
+# 🚚 Маршрутный лист слота для курьера: заявки сгруппированы по улицам и домам
+async def post_manifest(date, time_slot):
+    orders = await order_store.open_orders(date, time_slot)
+    if not orders:
+        return
+    for chunk in format_manifest(date, time_slot, group_by_address(orders), encode_order_id):
+        outbox.post(GROUP_CHAT_ID, lambda chunk=chunk: bot.send_message(GROUP_CHAT_ID, chunk))
+
+def slot_start(date, time_slot):
+    try:
+        day = datetime.strptime(date, "%d.%m.%Y")
+        hour = int(time_slot.split(":")[0])
+    except (TypeError, ValueError):
+        return None
+    return MOSCOW.localize(day.replace(hour=hour))
+
+# ➕ Оплату подтвердили, когда маршрут слота уже ушёл курьеру, — досылаем заявку отдельно
+async def post_manifest_addendum(order):
+    start = slot_start(order.get("date"), order.get("time_slot"))
+    lead = timedelta(minutes=MANIFEST_LEAD_MINUTES)
+    if start is None or not start - lead <= now_msk() < start + timedelta(hours=1):
+        return
+    chunks = format_manifest(
+        order["date"], order["time_slot"], group_by_address([order]), encode_order_id, title="➕ Дополнение к маршруту"
+    )
+    for chunk in chunks:
+        outbox.post(GROUP_CHAT_ID, lambda chunk=chunk: bot.send_message(GROUP_CHAT_ID, chunk))
+
+async def manifest_job(job):
+    start = datetime.fromtimestamp(job["run_at"], MOSCOW) + timedelta(minutes=MANIFEST_LEAD_MINUTES)
+    await post_manifest(start.strftime("%d.%m.%Y"), f"{start.hour}:00")
+
+# 🔔 Напоминание клиенту накануне вывоза
+async def schedule_reminder(order_id, user_id, date, time_slot):
+    try:
+        day = MOSCOW.localize(datetime.strptime(date, "%d.%m.%Y"))
+    except ValueError:
+        return
+    run_at = day - timedelta(days=1) + timedelta(hours=REMINDER_HOUR)
+    if run_at > now_msk():
+        await scheduler.schedule(
+            "reminder", run_at, {"order_id": order_id, "user_id": user_id}, job_id=f"reminder:{order_id}"
+        )
+
+async def reminder_job(job):
+    order = await order_store.get(job["payload"]["order_id"])
+    if order is None or order["status"] not in OPEN_STATUSES:
+        return
+    user_id = order["user_id"]
+    text = f"🔔 Напоминаем: завтра, {order['date']}, в {order['time_slot']} курьер заберёт мусор."
+    await outbox.send(user_id, lambda: bot.send_message(user_id, text))
+
+# 🧹 Удаляем черновики заявок, брошенные дольше FSM_DRAFT_TTL секунд назад
+async def cleanup_drafts_job(job):
+    if isinstance(storage, SQLiteStorage):
+        removed = await storage.purge(FSM_DRAFT_TTL)
+        if removed:
+            print(f"[Очистка] Удалено брошенных черновиков: {removed}")
+
+# 🗜 Убираем из индекса занятости прошедшие даты
+async def compact_slots_job(job):
+    await slot_index.compact(now_msk().date())
+
+# 🔁 Задачи, запланированные другими процессами, и журнал принятых обновлений
+async def sync_jobs_job(job):
+    await scheduler.sync()
+
+async def prune_dedup_job(job):
+    await dedup.prune(24 * 3600)
+    await albums.prune(3600)
+
+# 📤 Ночная выгрузка для аналитики. Статусы меняются ещё несколько дней
+# после вывоза, поэтому перезаписываем последнюю неделю
+async def export_analytics_job(job):
+    since = now_msk().date() - timedelta(days=7)
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(None, export_analytics, ORDERS_DB, ANALYTICS_DIR, since)
+    print(f"[Аналитика] Выгружено заказов: {result['orders']} за {result['days']} дн.")
+
+# 📊 Итоги дня в админ-группу
+async def daily_stats_job(job):
+    today = now_msk().strftime("%d.%m.%Y")
+    stats = await order_store.daily_stats(today)
+    total = sum(count for count, _ in stats.values())
+    revenue = sum(amount for _, amount in stats.values())
+    lines = [f"📊 <b>Итоги за {today}</b>", f"📦 Заявок: {total}", f"💳 Сумма: {revenue} ₽"]
+    lines += [f"• {status}: {count}" for status, (count, _) in sorted(stats.items())]
+    text = "\n".join(lines)
+    outbox.post(GROUP_CHAT_ID, lambda: bot.send_message(GROUP_CHAT_ID, text))
+
+scheduler.register("reminder", reminder_job)
+scheduler.every("expire_reservations", expire_reservations_job, every(60))
+scheduler.every("manifest", manifest_job, next_manifest_run)
+scheduler.every("cleanup_drafts", cleanup_drafts_job, every(3600))
+scheduler.every("compact_slots", compact_slots_job, daily_at(0, 5))
+scheduler.every("daily_stats", daily_stats_job, daily_at(21, 0))
+if ANALYTICS_DIR:
+    scheduler.every("export_analytics", export_analytics_job, daily_at(0, 30))
+if SHARED:
+    scheduler.every("sync_jobs", sync_jobs_job, every(30))
+    scheduler.every("prune_dedup", prune_dedup_job, every(3600))
+
+background = set()  # ожидание ведущей роли на не-ведущих процессах
+
+# 👑 Фоновые задачи и регистрацию webhook выполняет только ведущий процесс.
+# Остальные ждут, пока блокировка освободится, и тогда запускают планировщик
+async def lead_when_free():
+    await lease.wait()
+    print(f"[Workers] Процесс {os.getpid()} стал ведущим")
+    await scheduler.start()
+
 # 🔄 Действия при запуске приложения
 async def on_startup(app):
-    await bot.delete_webhook()
-    await bot.set_webhook(WEBHOOK_URL)
+    await order_store.open()
+    leader = lease.try_acquire()
+    if leader:
+        migrated = await order_store.migrate_csv(ORDERS_CSV)
+        if migrated:
+            print(f"[Миграция] Перенесено заказов из {ORDERS_CSV}: {migrated}")
+    await slot_index.rebuild(order_store)
+    await reservations.load()
+    outbox.start()
+    if WEBHOOK_MODE == "queue":
+        update_queue.start()
+    if leader:
+        await scheduler.start()
+        await bot.delete_webhook()
+        await bot.set_webhook(WEBHOOK_URL)
+    else:
+        background.add(asyncio.create_task(lead_when_free()))
+
+# 🛑 Действия при остановке приложения
+async def on_shutdown(app):
+    for task in background:
+        task.cancel()
+    if WEBHOOK_MODE == "queue":
+        await update_queue.stop()
+    await scheduler.stop()
+    await outbox.stop()
+    await order_store.close()
+    await storage.close()
+    if SHARED:
+        await dedup.close()
+        await albums.close()
+    lease.release()
+    await bot.session.close()
 
 # 🏗️ Инициализация aiohttp-приложения
 app = web.Application()
 app.router.add_post("/webhook", webhook_handler)
+app.router.add_get("/queue", queue_stats)
+app.router.add_get("/metrics", metrics_handler)
 app.on_startup.append(on_startup)
+app.on_shutdown.append(on_shutdown)
+
+# 🔁 Перевод заявки по кнопке админа. Возвращает user_id клиента
+# или None, если статус уже обновлён (повторное нажатие)
+async def advance_order(callback: CallbackQuery, status):
+    ref = callback.data.split("_", 1)[1]
+    if ref.isdigit():
+        # Кнопки старого формата несут только user_id
+        return {"user_id": int(ref)}
+
+    order_id = decode_order_id(ref)
+    order = await order_store.advance(order_id, status) if order_id is not None else None
+    if order is None:
+        await callback.answer("ℹ️ Статус этой заявки уже обновлён.")
+        return None
+    return order
+
+# 📬 Уведомление клиента о смене статуса. Статус уже записан, поэтому ошибка отправки
+# (клиент заблокировал бота, исчерпаны повторы после 429) не должна прерывать обработку кнопки
+async def notify_customer(user_id, text):
+    try:
+        await outbox.send(user_id, lambda: bot.send_message(user_id, text))
+    except Exception as e:
+        print(f"[Ошибка уведомления клиента {user_id}] {e}")
+        return False
+    return True
 
 @dp.callback_query(F.data.startswith("confirm_"))
 async def confirm_payment(callback: CallbackQuery):
-    user_id = int(callback.data.split("_")[1])
-
-    await bot.send_message(user_id, "✅ Оплата подтверждена. Курьер в ближайшее время заберёт мусор.")
-    await callback.answer("Оплата подтверждена.")
+    order = await advance_order(callback, "confirmed")
+    if order is None:
+        return
+    user_id = order["user_id"]
+    await post_manifest_addendum(order)
+    ref = callback.data.split("_", 1)[1]
 
-    # Кнопки для статуса
+    # Кнопки для статуса — до уведомления клиента, чтобы заявку можно было вести дальше в любом случае
     status_keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
-            [InlineKeyboardButton(text="✅ Мусор забрали", callback_data=f"pickedup_{user_id}")],
-            [InlineKeyboardButton(text="🚮 Мусор выброшен", callback_data=f"dumped_{user_id}")]
+            [InlineKeyboardButton(text="✅ Мусор забрали", callback_data=f"pickedup_{ref}")],
+            [InlineKeyboardButton(text="🚮 Мусор выброшен", callback_data=f"dumped_{ref}")]
         ]
     )
 
-    await callback.message.answer("📦 Отслеживание заявки:", reply_markup=status_keyboard)
+    outbox.post(
+        GROUP_CHAT_ID,
+        lambda: bot.send_message(GROUP_CHAT_ID, "📦 Отслеживание заявки:", reply_markup=status_keyboard),
+    )
+
+    if await notify_customer(user_id, "✅ Оплата подтверждена. Курьер в ближайшее время заберёт мусор."):
+        await callback.answer("Оплата подтверждена.")
+    else:
+        await callback.answer("Оплата подтверждена, но клиенту не удалось отправить сообщение.", show_alert=True)
 
 @dp.callback_query(F.data.startswith("pickedup_"))
 async def picked_up(callback: CallbackQuery):
-    user_id = int(callback.data.split("_")[1])
-    await bot.send_message(user_id, "✅ Курьер забрал мусор.")
-    await callback.answer("Клиенту отправлено: мусор забрали.")
+    order = await advance_order(callback, "picked_up")
+    if order is None:
+        return
+    user_id = order["user_id"]
+    if await notify_customer(user_id, "✅ Курьер забрал мусор."):
+        await callback.answer("Клиенту отправлено: мусор забрали.")
+    else:
+        await callback.answer("Статус обновлён, но клиенту не удалось отправить сообщение.", show_alert=True)
 
 @dp.callback_query(F.data.startswith("dumped_"))
 async def dumped(callback: CallbackQuery):
-    user_id = int(callback.data.split("_")[1])
-    await bot.send_message(user_id, "🚮 Мусор выброшен. Спасибо, что пользуетесь нашим сервисом!")
-    await callback.answer("Клиенту отправлено: мусор выброшен.")
+    order = await advance_order(callback, "dumped")
+    if order is None:
+        return
+    user_id = order["user_id"]
+    if await notify_customer(user_id, "🚮 Мусор выброшен. Спасибо, что пользуетесь нашим сервисом!"):
+        await callback.answer("Клиенту отправлено: мусор выброшен.")
+    else:
+        await callback.answer("Статус обновлён, но клиенту не удалось отправить сообщение.", show_alert=True)
 
 # 🚀 Запуск приложения
 if __name__ == "__main__":
-    web.run_app(app, port=PORT)
+    if WORKERS > 1:
+        serve_workers(lambda sock: web.run_app(app, sock=sock), WORKERS, PORT)
+    else:
+        web.run_app(app, port=PORT)
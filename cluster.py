@@ -0,0 +1,249 @@
+import asyncio
+import fcntl
+import json
+import os
+import signal
+import socket
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LeaderLease:
+    # 👑 Выбор ведущего процесса через flock на общем файле.
+    # Блокировку держит ровно один процесс; когда он завершается, ОС её снимает,
+    # и следующий процесс, пытающийся её взять, становится ведущим.
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def try_acquire(self):
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    @property
+    def is_leader(self):
+        return self._fd is not None
+
+    async def wait(self, interval=5.0):
+        while not self.try_acquire():
+            await asyncio.sleep(interval)
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+class SharedDedup:
+    # 🔁 Общий для всех процессов список уже принятых update_id (SQLite)
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dedup-db")
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS seen_updates (update_id INTEGER PRIMARY KEY, seen_at REAL)")
+            self._conn = conn
+        return self._conn
+
+    def _remember(self, update_id):
+        conn = self._connect()
+        with conn:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO seen_updates (update_id, seen_at) VALUES (?, ?)", (update_id, time.time())
+            )
+        return cur.rowcount == 0
+
+    async def seen(self, update_id):
+        # True, если обновление уже принято каким-то процессом
+        return await self._run(self._remember, update_id)
+
+    def _forget(self, update_id):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM seen_updates WHERE update_id = ?", (update_id,))
+
+    async def forget(self, update_id):
+        # Обновление не принято (очередь полна или обработка упала) — повтор от Telegram пропускаем
+        await self._run(self._forget, update_id)
+
+    def _prune(self, cutoff):
+        conn = self._connect()
+        with conn:
+            return conn.execute("DELETE FROM seen_updates WHERE seen_at < ?", (cutoff,)).rowcount
+
+    async def prune(self, max_age):
+        return await self._run(self._prune, time.time() - max_age)
+
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+
+class SharedAlbums:
+    # 🖼 Сборка альбома (media_group_id), общая для всех процессов (SQLite).
+    # Фото одного альбома приходят отдельными обновлениями и при WORKERS > 1
+    # разбираются разными процессами. Каждое фото пишется в общую таблицу, а собирает
+    # альбом процесс, первым его увидевший: когда за window секунд фото не прибавилось,
+    # он забирает все фото альбома и один раз вызывает commit(items).
+    # Если собравший процесс пропал, альбом подхватывает следующий, получивший его фото.
+
+    def __init__(self, path, window=0.5, max_wait=5.0):
+        self.path = path
+        self.window = window
+        self.max_wait = max_wait
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="albums-db")
+        self._tasks = set()
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(
+                "CREATE TABLE IF NOT EXISTS albums (album TEXT PRIMARY KEY, claimed_at REAL);"
+                "CREATE TABLE IF NOT EXISTS album_items (album TEXT, item TEXT);"
+                "CREATE INDEX IF NOT EXISTS idx_album_items ON album_items (album);"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _add(self, album, item, now):
+        # True, если собирать альбом выпало этому процессу
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT INTO album_items (album, item) VALUES (?, ?)", (album, json.dumps(item)))
+            row = conn.execute("SELECT claimed_at FROM albums WHERE album = ?", (album,)).fetchone()
+            claimed = row is None or now - row[0] > self.max_wait + 2 * self.window
+            if claimed:
+                conn.execute("INSERT OR REPLACE INTO albums (album, claimed_at) VALUES (?, ?)", (album, now))
+            conn.commit()
+            return claimed
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _count(self, album):
+        return self._connect().execute("SELECT COUNT(*) FROM album_items WHERE album = ?", (album,)).fetchone()[0]
+
+    def _take(self, album):
+        conn = self._connect()
+        with conn:
+            items = [
+                json.loads(row[0])
+                for row in conn.execute("SELECT item FROM album_items WHERE album = ? ORDER BY rowid", (album,))
+            ]
+            conn.execute("DELETE FROM album_items WHERE album = ?", (album,))
+            conn.execute("DELETE FROM albums WHERE album = ?", (album,))
+        return items
+
+    def add(self, key, item, commit):
+        task = asyncio.create_task(self._collect(":".join(map(str, key)), item, commit))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _collect(self, album, item, commit):
+        try:
+            if not await self._run(self._add, album, item, time.time()):
+                return
+            deadline = time.monotonic() + self.max_wait
+            size = await self._run(self._count, album)
+            while True:
+                await asyncio.sleep(self.window)
+                current = await self._run(self._count, album)
+                if current == size or time.monotonic() >= deadline:
+                    break
+                size = current
+            items = await self._run(self._take, album)
+            if items:
+                await commit(items)
+        except Exception as e:
+            print(f"[Ошибка обработки альбома {album}] {e}")
+
+    def _prune(self, cutoff):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "DELETE FROM album_items WHERE album IN (SELECT album FROM albums WHERE claimed_at < ?)", (cutoff,)
+            )
+            return conn.execute("DELETE FROM albums WHERE claimed_at < ?", (cutoff,)).rowcount
+
+    async def prune(self, max_age):
+        # Альбомы, которые так никто и не собрал
+        return await self._run(self._prune, time.time() - max_age)
+
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+
+def serve_workers(run_worker, workers, port, host="0.0.0.0"):
+    # 🧵 Несколько процессов на одном порту: сокет открывается до fork,
+    # и все workers принимают соединения из общей очереди ядра.
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(sock)
+            finally:
+                os._exit(0)
+        return pid
+
+    children = {spawn() for _ in range(workers)}
+    stopping = False
+
+    def forward(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    while children:
+        pid, status = os.wait()
+        children.discard(pid)
+        if not stopping:
+            # Упавший worker заменяем новым
+            print(f"[Workers] Процесс {pid} завершился ({status}), запускаем замену")
+            children.add(spawn())
+    sock.close()
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram import Bot
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL DEFAULT '{}',
+    updated_at REAL
+);
+"""
+
+
+def make_key(key: StorageKey):
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.destiny}"
+
+
+class SQLiteStorage(BaseStorage):
+    # 💾 FSM-хранилище в SQLite, переживающее перезапуск бота.
+    # Чтения обслуживает кэш в памяти, а изменения копятся и раз в
+    # flush_interval секунд пишутся одной транзакцией — несколько
+    # update_data за одно обновление стоят одной записи на диск.
+    # Кэш ограничен cache_size последними ключами (LRU); cache=False отключает
+    # кэш чистых записей, а flush_interval=None пишет каждое изменение сразу —
+    # так несколько процессов на одной базе видят изменения друг друга.
+    # В этом режиме каждое изменение — чтение и запись одной транзакцией
+    # BEGIN IMMEDIATE, поэтому update_data из разных процессов не теряют друг друга.
+
+    def __init__(self, path, flush_interval=0.05, cache=True, cache_size=10000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.cache = cache
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # ключ -> (состояние, данные)
+        self._dirty = {}  # ключ -> (состояние, данные), ещё не записанные на диск
+        self._flush_task = None
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-db")
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _load(self, key):
+        row = self._connect().execute("SELECT state, data FROM fsm WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    def _store(self, conn, key, record, now):
+        state, data = record
+        if state is None and not data:
+            conn.execute("DELETE FROM fsm WHERE key = ?", (key,))
+        else:
+            conn.execute(
+                "INSERT OR REPLACE INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?)",
+                (key, state, json.dumps(data, ensure_ascii=False), now),
+            )
+
+    def _write(self, records):
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            for key, record in records.items():
+                self._store(conn, key, record, now)
+
+    def _modify(self, key, change):
+        # BEGIN IMMEDIATE сразу берёт блокировку записи: другой процесс
+        # не изменит запись между нашим чтением и записью
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            record = change(*self._load(key))
+            self._store(conn, key, record, time.time())
+            conn.commit()
+            return record
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _remember(self, key, record):
+        if not self.cache:
+            return
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _read(self, key):
+        record = self._dirty.get(key) or self._cache.get(key)
+        if record is None:
+            record = await self._run(self._load, key)
+            # Пока шло чтение, запись могла измениться — свежие данные важнее
+            record = self._dirty.get(key) or self._cache.get(key) or record
+            self._remember(key, record)
+        return record
+
+    async def _change(self, key, change):
+        # Изменение записи функцией change(состояние, данные) -> (состояние, данные)
+        if self.flush_interval is None:
+            record = await self._run(self._modify, key, change)
+            self._remember(key, record)
+            return record
+        record = change(*await self._read(key))
+        await self._put(key, record)
+        return record
+
+    async def _put(self, key, record):
+        self._dirty[key] = record
+        self._remember(key, record)
+        if self.flush_interval is None:
+            await self.flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"[Ошибка записи FSM] {e}")
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        records, self._dirty = self._dirty, {}
+        try:
+            await self._run(self._write, records)
+        except Exception:
+            # Не теряем изменения: более новые записи остаются приоритетнее
+            self._dirty = {**records, **self._dirty}
+            raise
+
+    def _purge(self, cutoff):
+        conn = self._connect()
+        with conn:
+            keys = [row[0] for row in conn.execute("SELECT key FROM fsm WHERE updated_at < ?", (cutoff,))]
+            conn.execute("DELETE FROM fsm WHERE updated_at < ?", (cutoff,))
+        return keys
+
+    async def purge(self, max_age):
+        # Удаляет черновики, которые не менялись дольше max_age секунд
+        keys = await self._run(self._purge, time.time() - max_age)
+        for key in keys:
+            if key not in self._dirty:
+                self._cache.pop(key, None)
+        return len(keys)
+
+    async def set_state(self, bot: Bot, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        await self._change(make_key(key), lambda _, data: (state, data))
+
+    async def get_state(self, bot: Bot, key: StorageKey):
+        state, _ = await self._read(make_key(key))
+        return state
+
+    async def set_data(self, bot: Bot, key: StorageKey, data):
+        data = data.copy()
+        await self._change(make_key(key), lambda state, _: (state, data))
+
+    async def get_data(self, bot: Bot, key: StorageKey):
+        _, data = await self._read(make_key(key))
+        return data.copy()
+
+    async def update_data(self, bot: Bot, key: StorageKey, data):
+        _, merged = await self._change(make_key(key), lambda state, current: (state, {**current, **data}))
+        return merged.copy()
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        await self.flush()
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,97 @@
+import html
+import re
+from collections import defaultdict
+
+# 🚚 Маршрутные листы курьера: заявки слота, сгруппированные по улице и дому
+
+STREET_TYPES = re.compile(
+    r"\b(ул|улица|пр-т|пр-кт|просп|проспект|пер|переулок|ш|шоссе|б-р|бульвар|наб|набережная|пл|площадь|проезд|мкр)\b\.?"
+)
+HOUSE = re.compile(
+    r"(?:^|[\s,])(?:д\.?|дом)?\s*(?P<number>\d+)\s*(?P<letter>[а-яa-z](?![а-яa-z\d]|\s*\d))?"
+    r"(?:\s*(?:к|корп\.?|корпус|с|стр\.?|строение)\s*(?P<block>\d+))?"
+)
+# Число, за которым идёт слово или порядковое окончание, — часть названия улицы
+# («ул. 8 Марта», «2-я Тверская-Ямская», «ул. 1905 года»), а не номер дома
+STREET_NUMBER = re.compile(r"-[а-яa-z]|\s*[а-яa-z]{2,}")
+# Квартира, подъезд, этаж и код идут после дома — их числа домом не считаем
+DETAILS = re.compile(r"[\s,](?:кв|квартира|подъезд|под|эт|этаж|код|домофон|оф|офис)\b")
+MAX_MESSAGE_LENGTH = 4096
+
+
+def parse_address(address):
+    # Возвращает (улица, дом) в нормализованном виде для группировки.
+    # Дом — кортеж (номер, литера, корпус), чтобы 5 < 5а < 12 сортировались естественно.
+    text = " ".join(address.lower().replace("ё", "е").split())
+    details = DETAILS.search(text)
+    head = text[:details.start()] if details else text
+    match = first = None
+    for candidate in HOUSE.finditer(head):
+        if not STREET_NUMBER.match(head, candidate.end()):
+            match = candidate
+            break
+        first = first or candidate
+    match = match or first
+    if match is None:
+        return STREET_TYPES.sub(" ", text).strip(" ,.") or text, (0, "", 0)
+    street = STREET_TYPES.sub(" ", text[:match.start()])
+    street = " ".join(street.replace(",", " ").replace(".", " ").split()) or "—"
+    house = (int(match["number"]), match["letter"] or "", int(match["block"] or 0))
+    return street, house
+
+
+def format_house(house):
+    number, letter, block = house
+    if not number:
+        return "без номера дома"
+    return f"д. {number}{letter}" + (f" к{block}" if block else "")
+
+
+def group_by_address(orders):
+    # Один проход для группировки и сортировка внутри групп: O(n log n) на день
+    streets = defaultdict(lambda: defaultdict(list))
+    for order in orders:
+        street, house = parse_address(order.get("address") or "")
+        streets[street][house].append(order)
+    return [
+        (street, [(house, houses[house]) for house in sorted(houses)])
+        for street, houses in sorted(streets.items())
+    ]
+
+
+def build_manifests(orders):
+    # (дата, время) -> группы заявок по улицам и домам
+    slots = defaultdict(list)
+    for order in orders:
+        slots[(order["date"], order["time_slot"])].append(order)
+    return {slot: group_by_address(slot_orders) for slot, slot_orders in slots.items()}
+
+
+def format_manifest(date, time_slot, groups, encode_ref=None, title="🚚 Маршрут"):
+    total = sum(len(orders) for _, houses in groups for _, orders in houses)
+    lines = [f"<b>{title} на {date}, {time_slot}</b>", f"📦 Заявок: {total}", ""]
+    stop = 0
+    for street, houses in groups:
+        lines.append(f"📍 <b>{html.escape(street.title())}</b>")
+        for house, orders in houses:
+            stop += 1
+            lines.append(f"{stop}. {format_house(house)}")
+            for order in orders:
+                ref = f" <code>{encode_ref(order['id'])}</code>" if encode_ref and order.get("id") else ""
+                address = html.escape(order.get("address") or "—")
+                lines.append(f"   • {address} — {order.get('transfer') or '—'}{ref}")
+        lines.append("")
+    return split_message("\n".join(lines).rstrip())
+
+
+def split_message(text, limit=MAX_MESSAGE_LENGTH):
+    # Telegram не принимает сообщения длиннее 4096 символов — режем по строкам
+    chunks, current = [], ""
+    for line in text.split("\n"):
+        if current and len(current) + len(line) + 1 > limit:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line[:limit]
+    if current:
+        chunks.append(current)
+    return chunks
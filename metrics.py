@@ -0,0 +1,212 @@
+import cProfile
+import io
+import pstats
+import random
+import time
+from bisect import bisect_left
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value).replace(chr(34), chr(39))}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, count in self.values.items():
+            lines.append(f"{self.name}{_labels(self.labels, values)} {count}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # значения меток -> [счётчики по корзинам..., сумма, количество]
+
+    def observe(self, value, *label_values):
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [0] * (len(self.buckets) + 2)
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        for values, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, values + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(names, values + ('+Inf',))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, values)} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labels, values)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    # 📈 Набор метрик в текстовом формате Prometheus
+
+    def __init__(self):
+        self.metrics = []
+        self.gauges = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, prefix, help, collect):
+        # collect() возвращает словарь {имя: число}, значения читаются при каждом запросе /metrics
+        self.gauges.append((prefix, help, collect))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for prefix, help, collect in self.gauges:
+            for key, value in collect().items():
+                if isinstance(value, (int, float)):
+                    lines.append(f"# HELP {prefix}_{key} {help}")
+                    lines.append(f"# TYPE {prefix}_{key} gauge")
+                    lines.append(f"{prefix}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+handler_latency = registry.histogram(
+    "bot_handler_latency_seconds", "Время работы обработчика", ("handler",)
+)
+handler_errors = registry.counter("bot_handler_errors_total", "Исключения в обработчиках", ("handler",))
+api_latency = registry.histogram("bot_api_latency_seconds", "Время запроса к Bot API", ("method",))
+api_errors = registry.counter("bot_api_errors_total", "Ошибки запросов к Bot API", ("method", "error"))
+storage_latency = registry.histogram(
+    "bot_fsm_storage_latency_seconds", "Время операции FSM-хранилища", ("op",),
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5),
+)
+fsm_transitions = registry.counter("bot_fsm_transitions_total", "Переходы по состояниям заявки", ("state",))
+slow_updates = registry.counter("bot_slow_updates_total", "Обновления дольше порога", ("handler",))
+
+
+# cProfile — один на поток: пока идёт профиль одного обновления, остальные не профилируются
+_profiling = False
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    # ⏱ Замер времени каждого обработчика.
+    # С вероятностью profile_rate обновление выполняется под cProfile,
+    # и если оно дольше slow_threshold секунд, профиль печатается в лог.
+    # Обновления обрабатываются вперемешку на одном event loop, поэтому в профиль
+    # попадает и работа соседних обновлений во время ожиданий этого.
+
+    def __init__(self, slow_threshold=1.0, profile_rate=0.0):
+        self.slow_threshold = slow_threshold
+        self.profile_rate = profile_rate
+
+    async def __call__(self, handler, event, data):
+        global _profiling
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        profiler = None
+        if self.profile_rate and not _profiling and random.random() < self.profile_rate:
+            profiler = cProfile.Profile()
+            _profiling = True
+        started = time.perf_counter()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            handler_latency.observe(elapsed, name)
+            if profiler is not None:
+                profiler.disable()
+                _profiling = False
+            if elapsed >= self.slow_threshold:
+                slow_updates.inc(name)
+                if profiler is not None:
+                    out = io.StringIO()
+                    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(15)
+                    print(f"[Медленное обновление] {name}: {elapsed:.3f} с\n{out.getvalue()}")
+
+
+class RequestMetricsMiddleware(BaseRequestMiddleware):
+    # ⏱ Замер времени и ошибок запросов к Bot API
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            api_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            api_latency.observe(time.perf_counter() - started, name)
+
+
+class InstrumentedStorage(BaseStorage):
+    # ⏱ Обёртка над FSM-хранилищем: время операций и счётчик переходов состояний
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    async def _timed(self, op, call):
+        started = time.perf_counter()
+        try:
+            return await call
+        finally:
+            storage_latency.observe(time.perf_counter() - started, op)
+
+    async def set_state(self, bot, key, state=None):
+        fsm_transitions.inc(state.state if isinstance(state, State) else state or "none")
+        await self._timed("set_state", self.storage.set_state(bot=bot, key=key, state=state))
+
+    async def get_state(self, bot, key):
+        return await self._timed("get_state", self.storage.get_state(bot=bot, key=key))
+
+    async def set_data(self, bot, key, data):
+        await self._timed("set_data", self.storage.set_data(bot=bot, key=key, data=data))
+
+    async def get_data(self, bot, key):
+        return await self._timed("get_data", self.storage.get_data(bot=bot, key=key))
+
+    async def update_data(self, bot, key, data):
+        return await self._timed("update_data", self.storage.update_data(bot=bot, key=key, data=data))
+
+    async def close(self):
+        await self.storage.close()
@@ -0,0 +1,456 @@
+import asyncio
+import csv
+import os
+import sqlite3
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# 📦 Лимит заказов на один временной слот
+SLOT_CAPACITY = 15
+
+# 🧾 Услуги и их цены, ₽
+PRODUCTS = {
+    "🧺 Один пакет мусора": 100,
+    "🗑️ 2–3 пакета мусора": 200,
+    "🛢 Крупный мусор": 500
+}
+
+# Колонки старого orders.csv (row[3] — дата, row[4] — время)
+ORDER_FIELDS = ["user_id", "username", "product", "date", "time_slot", "address", "transfer", "price"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    username TEXT,
+    product TEXT,
+    date TEXT,
+    time_slot TEXT,
+    address TEXT,
+    transfer TEXT,
+    price INTEGER,
+    status TEXT NOT NULL DEFAULT 'pending_payment',
+    created_at TEXT,
+    confirmed_at TEXT,
+    picked_up_at TEXT,
+    dumped_at TEXT
+);
+CREATE INDEX IF NOT EXISTS orders_slot ON orders (date, time_slot);
+CREATE INDEX IF NOT EXISTS orders_user ON orders (user_id);
+CREATE TABLE IF NOT EXISTS holds (
+    user_id INTEGER PRIMARY KEY,
+    date TEXT,
+    time_slot TEXT,
+    expires_at REAL
+);
+"""
+
+
+# 🔁 Жизненный цикл заявки: в какой статус из каких можно перейти.
+# Вывоз можно отметить и без отдельного «забрали».
+# OPEN_STATUSES — оплаченные, но ещё не вывезенные: они идут в маршрут и напоминания
+OPEN_STATUSES = ("confirmed", "picked_up")
+TRANSITIONS = {
+    "confirmed": ("pending_payment",),
+    "picked_up": ("confirmed",),
+    "dumped": ("confirmed", "picked_up"),
+}
+
+
+def encode_order_id(order_id):
+    # Короткий номер заявки для callback_data: «o» + номер в base36
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    encoded = ""
+    while True:
+        order_id, rest = divmod(order_id, 36)
+        encoded = digits[rest] + encoded
+        if not order_id:
+            return "o" + encoded
+
+
+def decode_order_id(ref):
+    if not ref.startswith("o"):
+        return None
+    try:
+        return int(ref[1:], 36)
+    except ValueError:
+        return None
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, "%d.%m.%Y").date()
+    except (TypeError, ValueError):
+        return datetime.max.date()  # непонятные даты не трогаем
+
+
+def utc_now():
+    return datetime.utcnow().isoformat(timespec="seconds")
+
+
+class OrderStore:
+    # 💾 История заказов в SQLite (WAL).
+    # Все обращения к базе идут через один поток-исполнитель:
+    # соединение не делится между потоками, а медленный диск не тормозит event loop.
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="orders-db")
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        # Базы, созданные до появления отметок статусов, дополняем недостающими колонками
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(orders)")}
+        for column in ("confirmed_at", "picked_up_at", "dumped_at"):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE orders ADD COLUMN {column} TEXT")
+        self._conn = conn
+
+    async def open(self):
+        await self._run(self._open)
+
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+    def _migrate_csv(self, csv_path):
+        # Переносим старый orders.csv один раз — только в пустую базу
+        if not os.path.exists(csv_path):
+            return 0
+        if self._conn.execute("SELECT 1 FROM orders LIMIT 1").fetchone():
+            return 0
+        with open(csv_path, "r", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            next(reader, None)  # заголовок
+            rows = (
+                (row + [""] * len(ORDER_FIELDS))[:len(ORDER_FIELDS)]
+                for row in reader if len(row) > 4
+            )
+            with self._conn:
+                cur = self._conn.executemany(
+                    f"INSERT INTO orders ({', '.join(ORDER_FIELDS)}) VALUES ({', '.join('?' * len(ORDER_FIELDS))})",
+                    rows,
+                )
+        return cur.rowcount
+
+    async def migrate_csv(self, csv_path):
+        return await self._run(self._migrate_csv, csv_path)
+
+    def _insert_order(self, order):
+        fields = [field for field in ORDER_FIELDS if field in order]
+        values = [order[field] for field in fields]
+        cur = self._conn.execute(
+            f"INSERT INTO orders ({', '.join(fields)}, created_at) VALUES ({', '.join('?' * len(fields))}, ?)",
+            values + [utc_now()],
+        )
+        return cur.lastrowid
+
+    def _append(self, order):
+        with self._conn:
+            return self._insert_order(order)
+
+    async def append(self, order):
+        return await self._run(self._append, order)
+
+    def _book(self, order, user_id):
+        # Запись заказа и снятие брони — одна транзакция
+        with self._conn:
+            order_id = self._insert_order(order)
+            self._conn.execute("DELETE FROM holds WHERE user_id = ?", (user_id,))
+        return order_id
+
+    async def book(self, order, user_id):
+        return await self._run(self._book, order, user_id)
+
+    def _save_hold(self, user_id, date, time_slot, expires_at):
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO holds (user_id, date, time_slot, expires_at) VALUES (?, ?, ?, ?)",
+                (user_id, date, time_slot, expires_at),
+            )
+
+    async def save_hold(self, user_id, date, time_slot, expires_at):
+        await self._run(self._save_hold, user_id, date, time_slot, expires_at)
+
+    def _delete_hold(self, user_id):
+        with self._conn:
+            self._conn.execute("DELETE FROM holds WHERE user_id = ?", (user_id,))
+
+    async def delete_hold(self, user_id):
+        await self._run(self._delete_hold, user_id)
+
+    def _delete_expired_holds(self, now):
+        with self._conn:
+            return self._conn.execute("DELETE FROM holds WHERE expires_at <= ?", (now,)).rowcount
+
+    async def delete_expired_holds(self, now):
+        return await self._run(self._delete_expired_holds, now)
+
+    def _load_holds(self, now):
+        rows = self._conn.execute(
+            "SELECT user_id, date, time_slot, expires_at FROM holds WHERE expires_at > ?", (now,)
+        )
+        return [tuple(row) for row in rows]
+
+    async def load_holds(self, now):
+        return await self._run(self._load_holds, now)
+
+    def _reserve_shared(self, user_id, date, time_slot, expires_at, capacity, now):
+        # BEGIN IMMEDIATE сразу берёт блокировку записи: другие процессы
+        # не могут захватить место между подсчётом и вставкой брони
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM holds WHERE user_id = ?", (user_id,))
+            booked = conn.execute(
+                "SELECT COUNT(*) FROM orders WHERE date = ? AND time_slot = ?", (date, time_slot)
+            ).fetchone()[0]
+            held = conn.execute(
+                "SELECT COUNT(*) FROM holds WHERE date = ? AND time_slot = ? AND expires_at > ?",
+                (date, time_slot, now),
+            ).fetchone()[0]
+            if booked + held >= capacity:
+                conn.rollback()  # прежняя бронь пользователя остаётся на месте
+                return False
+            conn.execute(
+                "INSERT INTO holds (user_id, date, time_slot, expires_at) VALUES (?, ?, ?, ?)",
+                (user_id, date, time_slot, expires_at),
+            )
+            conn.commit()
+            return True
+        except Exception:
+            conn.rollback()
+            raise
+
+    async def reserve_shared(self, user_id, date, time_slot, expires_at, capacity, now):
+        return await self._run(self._reserve_shared, user_id, date, time_slot, expires_at, capacity, now)
+
+    def _slot_taken(self, date, now):
+        taken = defaultdict(int)
+        for slot, count in self._conn.execute(
+            "SELECT time_slot, COUNT(*) FROM orders WHERE date = ? GROUP BY time_slot", (date,)
+        ):
+            taken[slot] += count
+        for slot, count in self._conn.execute(
+            "SELECT time_slot, COUNT(*) FROM holds WHERE date = ? AND expires_at > ? GROUP BY time_slot", (date, now)
+        ):
+            taken[slot] += count
+        return taken
+
+    async def slot_taken(self, date, now):
+        # Занятость слотов дня по базе: заказы плюс действующие брони
+        return await self._run(self._slot_taken, date, now)
+
+    def _query(self, filters):
+        where = " AND ".join(f"{column} = ?" for column in filters) or "1"
+        rows = self._conn.execute(
+            f"SELECT * FROM orders WHERE {where} ORDER BY id", list(filters.values())
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    async def query(self, date=None, time_slot=None, user_id=None, status=None):
+        filters = {
+            column: value
+            for column, value in (("date", date), ("time_slot", time_slot), ("user_id", user_id), ("status", status))
+            if value is not None
+        }
+        return await self._run(self._query, filters)
+
+    def _get(self, order_id):
+        row = self._conn.execute("SELECT * FROM orders WHERE id = ?", (order_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    async def get(self, order_id):
+        return await self._run(self._get, order_id)
+
+    def _advance(self, order_id, status):
+        allowed = TRANSITIONS[status]
+        with self._conn:
+            cur = self._conn.execute(
+                f"UPDATE orders SET status = ?, {status}_at = ? "
+                f"WHERE id = ? AND status IN ({', '.join('?' * len(allowed))})",
+                (status, utc_now(), order_id, *allowed),
+            )
+        return self._get(order_id) if cur.rowcount else None
+
+    async def advance(self, order_id, status):
+        # Переводит заявку в новый статус только из допустимого предыдущего.
+        # Повторное нажатие ничего не меняет и возвращает None.
+        return await self._run(self._advance, order_id, status)
+
+    def _open_orders(self, date, time_slot):
+        rows = self._conn.execute(
+            f"SELECT * FROM orders WHERE date = ? AND time_slot = ? "
+            f"AND status IN ({', '.join('?' * len(OPEN_STATUSES))}) ORDER BY id",
+            (date, time_slot, *OPEN_STATUSES),
+        )
+        return [dict(row) for row in rows]
+
+    async def open_orders(self, date, time_slot):
+        return await self._run(self._open_orders, date, time_slot)
+
+    def _daily_stats(self, date):
+        rows = self._conn.execute(
+            "SELECT status, COUNT(*), COALESCE(SUM(price), 0) FROM orders WHERE date = ? GROUP BY status", (date,)
+        )
+        return {status: (count, revenue) for status, count, revenue in rows}
+
+    async def daily_stats(self, date):
+        # status -> (количество, сумма) за день
+        return await self._run(self._daily_stats, date)
+
+    def _slot_counts(self):
+        rows = self._conn.execute("SELECT date, time_slot, COUNT(*) FROM orders GROUP BY date, time_slot")
+        return {(date, slot): count for date, slot, count in rows}
+
+    async def slot_counts(self):
+        return await self._run(self._slot_counts)
+
+
+class SlotIndex:
+    # 📊 Занятость слотов: (дата, время) -> количество заказов.
+    # Загружается один раз при старте и обновляется при каждой записи заказа,
+    # поэтому выбор даты не перебирает всю историю заказов.
+
+    def __init__(self):
+        self._counts = defaultdict(int)
+        self._lock = asyncio.Lock()
+
+    async def rebuild(self, store):
+        counts = await store.slot_counts()
+        async with self._lock:
+            self._counts = defaultdict(int, counts)
+
+    def count(self, date, slot):
+        return self._counts.get((date, slot), 0)
+
+    def counts(self, date, slots):
+        return {slot: self._counts.get((date, slot), 0) for slot in slots}
+
+    def available(self, date, slots, capacity=SLOT_CAPACITY):
+        return [slot for slot in slots if self._counts.get((date, slot), 0) < capacity]
+
+    async def add(self, date, slot, n=1):
+        async with self._lock:
+            self._counts[(date, slot)] += n
+
+    async def compact(self, today):
+        # Убираем прошедшие даты: по ним заказы уже не принимаются
+        async with self._lock:
+            past = [key for key in self._counts if parse_date(key[0]) < today]
+            for key in past:
+                del self._counts[key]
+        return len(past)
+
+
+class ReservationBook:
+    # 🔒 Временная бронь слота на время оформления заказа.
+    # Проверка и захват места выполняются без await между ними, поэтому
+    # одновременные нажатия на одно время не могут превысить лимит.
+    # Неоплаченная бронь снимается по истечении ttl секунд.
+    # shared=True — режим нескольких процессов: счётчики в памяти не используются,
+    # проверка и захват места идут одной транзакцией в общей базе.
+
+    def __init__(self, store, index, ttl=900, capacity=SLOT_CAPACITY, shared=False):
+        self.store = store
+        self.index = index
+        self.ttl = ttl
+        self.capacity = capacity
+        self.shared = shared
+        self._holds = {}  # user_id -> (дата, время, срок)
+        self._by_slot = defaultdict(dict)  # (дата, время) -> {user_id: срок}
+
+    async def load(self):
+        if self.shared:
+            return
+        for user_id, date, slot, expires_at in await self.store.load_holds(time.time()):
+            self._claim(user_id, date, slot, expires_at)
+
+    def _claim(self, user_id, date, slot, expires_at):
+        self._holds[user_id] = (date, slot, expires_at)
+        self._by_slot[(date, slot)][user_id] = expires_at
+
+    def _drop(self, user_id):
+        hold = self._holds.pop(user_id, None)
+        if hold is None:
+            return None
+        date, slot, _ = hold
+        holders = self._by_slot.get((date, slot))
+        if holders is not None:
+            holders.pop(user_id, None)
+            if not holders:
+                del self._by_slot[(date, slot)]
+        return hold
+
+    def _held(self, date, slot, now):
+        holders = self._by_slot.get((date, slot))
+        if not holders:
+            return 0
+        expired = [user_id for user_id, expires_at in holders.items() if expires_at <= now]
+        for user_id in expired:
+            self._drop(user_id)  # удаляет и из holders
+        return len(holders)
+
+    def taken(self, date, slot, now=None):
+        return self.index.count(date, slot) + self._held(date, slot, now or time.time())
+
+    async def available(self, date, slots):
+        now = time.time()
+        if self.shared:
+            taken = await self.store.slot_taken(date, now)
+            return [slot for slot in slots if taken.get(slot, 0) < self.capacity]
+        return [slot for slot in slots if self.taken(date, slot, now) < self.capacity]
+
+    async def reserve(self, user_id, date, slot):
+        now = time.time()
+        if self.shared:
+            return await self.store.reserve_shared(user_id, date, slot, now + self.ttl, self.capacity, now)
+        previous = self._drop(user_id)
+        if previous is not None and previous[:2] == (date, slot):
+            previous = None  # повторное нажатие — просто продлеваем бронь
+        if self.taken(date, slot, now) >= self.capacity:
+            if previous is not None:
+                self._claim(user_id, *previous)
+            return False
+
+        expires_at = now + self.ttl
+        self._claim(user_id, date, slot, expires_at)
+        try:
+            await self.store.save_hold(user_id, date, slot, expires_at)
+        except Exception:
+            self._drop(user_id)
+            raise
+        return True
+
+    async def release(self, user_id):
+        if self.shared or self._drop(user_id) is not None:
+            await self.store.delete_hold(user_id)
+
+    async def book(self, user_id, order):
+        # Оплата уже получена, поэтому заказ записывается даже если бронь истекла
+        order_id = await self.store.book(order, user_id)
+        if self.shared:
+            return order_id
+        self._drop(user_id)
+        await self.index.add(order["date"], order["time_slot"])
+        return order_id
+
+    async def expire(self):
+        now = time.time()
+        expired = [user_id for user_id, (_, _, expires_at) in self._holds.items() if expires_at <= now]
+        for user_id in expired:
+            self._drop(user_id)
+        deleted = await self.store.delete_expired_holds(now)
+        return deleted if self.shared else len(expired)
@@ -0,0 +1,141 @@
+import asyncio
+import itertools
+from collections import OrderedDict
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from ratelimit import TokenBucket
+
+# Приоритеты: сообщения клиентам уходят раньше постов в админ-группу
+CUSTOMER = 0
+ADMIN = 1
+
+
+class OutboxClosed(Exception):
+    # Сообщение не отправлено: очередь остановлена раньше, чем до него дошло дело
+    pass
+
+
+class Outbox:
+    # 📤 Единая точка отправки сообщений через Bot API.
+    # Соблюдает лимиты Telegram: общий (global_rate в секунду), личный чат
+    # (private_rate в секунду) и группа (group_rate в секунду, по умолчанию 20 в минуту).
+    # На 429 ждёт retry_after от сервера и повторяет запрос.
+
+    def __init__(self, global_rate=30, private_rate=1, group_rate=20 / 60, max_retries=3, max_chats=10000):
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._chats = OrderedDict()  # chat_id -> (TokenBucket, asyncio.Lock)
+        self._queue = asyncio.PriorityQueue()
+        self._order = itertools.count()
+        self._task = None
+        self._deliveries = set()
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def _chat(self, chat_id):
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            # Отрицательный chat_id — группа, у групп лимит строже
+            rate = self.group_rate if chat_id < 0 else self.private_rate
+            chat = self._chats[chat_id] = (TokenBucket(rate), asyncio.Lock())
+            if len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return chat
+
+    def _submit(self, chat_id, call, priority, future):
+        self._queue.put_nowait((priority, next(self._order), chat_id, call, future))
+
+    async def send(self, chat_id, call, priority=CUSTOMER):
+        # call — функция без аргументов, возвращающая корутину запроса к Bot API
+        future = asyncio.get_running_loop().create_future()
+        self._submit(chat_id, call, priority, future)
+        return await future
+
+    def post(self, chat_id, call, priority=ADMIN):
+        # Отправка без ожидания результата, ошибки только пишутся в лог
+        self._submit(chat_id, call, priority, None)
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            try:
+                await self.global_bucket.acquire()
+            except asyncio.CancelledError:
+                self._fail(item[2], item[4], OutboxClosed("очередь отправки остановлена"))
+                raise
+            task = asyncio.create_task(self._deliver(*item[2:]))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+
+    async def _deliver(self, chat_id, call, future):
+        try:
+            await self._deliver_locked(chat_id, call, future)
+        except asyncio.CancelledError:
+            self._fail(chat_id, future, OutboxClosed("очередь отправки остановлена"))
+            raise
+
+    async def _deliver_locked(self, chat_id, call, future):
+        bucket, lock = self._chat(chat_id)
+        async with lock:
+            for attempt in itertools.count():
+                await bucket.acquire()
+                try:
+                    result = await call()
+                except TelegramRetryAfter as e:
+                    if attempt < self.max_retries:
+                        self.retried += 1
+                        bucket.block(e.retry_after)
+                        continue
+                    self._fail(chat_id, future, e)
+                except Exception as e:
+                    self._fail(chat_id, future, e)
+                else:
+                    self.sent += 1
+                    if future is not None and not future.done():
+                        future.set_result(result)
+                return
+
+    def _fail(self, chat_id, future, error):
+        self.failed += 1
+        if future is not None:
+            if not future.done():
+                future.set_exception(error)
+        else:
+            print(f"[Ошибка отправки в чат {chat_id}] {error}")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout=5.0):
+        # Досылаем очередь не дольше timeout секунд. Что не успело уйти, отменяется:
+        # ожидающие send() получают OutboxClosed, потерянные post() пишутся в лог
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        if self._task is not None:
+            while (not self._queue.empty() or self._deliveries) and loop.time() < deadline:
+                await asyncio.sleep(0.05)
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        for task in list(self._deliveries):
+            task.cancel()
+        await asyncio.gather(*self._deliveries, return_exceptions=True)
+        while not self._queue.empty():
+            _, _, chat_id, _, future = self._queue.get_nowait()
+            self._fail(chat_id, future, OutboxClosed("очередь отправки остановлена"))
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "in_flight": len(self._deliveries),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+        }
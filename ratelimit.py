@@ -0,0 +1,39 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    # 🪣 Классическое «ведро токенов»: rate токенов в секунду, не больше capacity про запас
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now=None):
+        # Сколько секунд ждать до следующего токена
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def try_acquire(self, now=None):
+        now = time.monotonic() if now is None else now
+        if self.delay(now) > 0:
+            return False
+        self.tokens -= 1
+        return True
+
+    async def acquire(self):
+        while not self.try_acquire():
+            await asyncio.sleep(self.delay())
+
+    def block(self, seconds):
+        # Сервер попросил подождать (429 retry_after)
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
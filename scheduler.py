@@ -0,0 +1,170 @@
+import asyncio
+import heapq
+import itertools
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    run_at REAL NOT NULL,
+    payload TEXT NOT NULL DEFAULT '{}'
+);
+"""
+
+
+def timestamp(moment):
+    return moment.timestamp() if isinstance(moment, datetime) else float(moment)
+
+
+class Scheduler:
+    # ⏰ Планировщик фоновых задач на одном event loop.
+    # Все таймеры лежат в одной куче и ждутся одной задачей, поэтому тысячи
+    # отложенных задач почти ничего не стоят. Задачи хранятся в SQLite и
+    # переживают перезапуск; пропущенные за время простоя выполняются сразу.
+    # Повторяющиеся задачи (every) после запуска сами планируют следующий.
+    # Незапущенный планировщик только сохраняет задачи в базу: их выполнит
+    # ведущий процесс, подхватив новые записи через sync().
+
+    def __init__(self, path):
+        self.path = path
+        self._handlers = {}
+        self._recurring = {}  # имя -> функция следующего запуска
+        self._heap = []
+        self._jobs = {}  # id -> (run_at, имя, payload); записи кучи без пары здесь устарели
+        self._order = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._running = set()
+        self._running_ids = set()
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs-db")
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _load(self):
+        return self._connect().execute("SELECT id, name, run_at, payload FROM jobs").fetchall()
+
+    def _save(self, job_id, name, run_at, payload):
+        with self._connect():
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, name, run_at, payload) VALUES (?, ?, ?, ?)",
+                (job_id, name, run_at, json.dumps(payload, ensure_ascii=False)),
+            )
+
+    def _delete(self, job_id):
+        with self._connect():
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def register(self, name, handler):
+        # handler(job) получает словарь с id, name, run_at и payload
+        self._handlers[name] = handler
+
+    def every(self, name, handler, next_run):
+        # next_run(now) возвращает время следующего запуска (datetime с часовым поясом)
+        self._handlers[name] = handler
+        self._recurring[name] = next_run
+
+    def _push(self, job_id, name, run_at, payload):
+        self._jobs[job_id] = (run_at, name, payload)
+        heapq.heappush(self._heap, (run_at, next(self._order), job_id))
+        self._wakeup.set()
+
+    async def schedule(self, name, run_at, payload=None, job_id=None):
+        run_at = timestamp(run_at)
+        payload = payload or {}
+        job_id = job_id or f"{name}:{next(self._order)}:{time.time_ns()}"
+        await self._run(self._save, job_id, name, run_at, payload)
+        if self._task is not None:
+            self._push(job_id, name, run_at, payload)
+        return job_id
+
+    async def cancel(self, job_id):
+        self._jobs.pop(job_id, None)
+        await self._run(self._delete, job_id)
+
+    async def sync(self):
+        # Подхватывает задачи, добавленные в базу другими процессами
+        added = 0
+        for job_id, name, run_at, payload in await self._run(self._load):
+            if job_id not in self._jobs and job_id not in self._running_ids:
+                self._push(job_id, name, run_at, json.loads(payload))
+                added += 1
+        return added
+
+    async def start(self):
+        self._task = asyncio.create_task(self._loop())
+        await self.sync()
+        now = datetime.now(timezone.utc)
+        for name, next_run in self._recurring.items():
+            if name not in self._jobs:
+                await self.schedule(name, next_run(now), job_id=name)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        for task in list(self._running):
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+    def pending(self):
+        return len(self._jobs)
+
+    async def _loop(self):
+        while True:
+            self._wakeup.clear()
+            # Пропускаем устаревшие записи кучи (отменённые или перепланированные задачи)
+            while self._heap and self._jobs.get(self._heap[0][2], (None,))[0] != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            run_at, _, job_id = self._heap[0]
+            delay = run_at - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            _, name, payload = self._jobs.pop(job_id)
+            task = asyncio.create_task(self._execute(job_id, name, run_at, payload))
+            self._running.add(task)
+            self._running_ids.add(job_id)
+            task.add_done_callback(self._running.discard)
+            task.add_done_callback(lambda _, job_id=job_id: self._running_ids.discard(job_id))
+
+    async def _execute(self, job_id, name, run_at, payload):
+        handler = self._handlers.get(name)
+        try:
+            if handler is None:
+                print(f"[Планировщик] Нет обработчика для задачи {name}")
+            else:
+                await handler({"id": job_id, "name": name, "run_at": run_at, "payload": payload})
+        except Exception as e:
+            print(f"[Ошибка задачи {job_id}] {e}")
+        finally:
+            next_run = self._recurring.get(name)
+            if next_run is not None and job_id == name:
+                await self.schedule(name, next_run(datetime.now(timezone.utc)), job_id=name)
+            elif job_id not in self._jobs:
+                await self._run(self._delete, job_id)
@@ -0,0 +1,83 @@
+import asyncio
+import os
+import sys
+
+import pytest
+from aiogram import types
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import GROUP_CHAT_ID, Updates, stub_api_app  # noqa: E402
+from outbox import Outbox  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def bot_module(tmp_path_factory):
+    # bot.py читает окружение при импорте, поэтому модуль один на все тесты;
+    # тесты разводятся по разным пользователям и датам
+    workdir = tmp_path_factory.mktemp("bot")
+    os.environ.update(
+        TOKEN="123456:test",
+        BOT_API_URL="http://127.0.0.1:9",
+        GROUP_CHAT_ID=str(GROUP_CHAT_ID),
+        ORDERS_DB=str(workdir / "orders.db"),
+        ORDERS_CSV=str(workdir / "orders.csv"),
+        FSM_STORAGE="memory",
+        THROTTLE="0",
+        ALBUM_WINDOW="0.05",
+    )
+    import bot
+
+    asyncio.run(bot.order_store.open())
+    yield bot
+    asyncio.run(bot.order_store.close())
+
+
+class BotHarness:
+    # Бот против заглушки Bot API: обновления подаются прямо в dp.feed_update
+
+    def __init__(self, bot_module, stub):
+        self.module = bot_module
+        self.stub = stub
+        self.updates = Updates()
+
+    async def feed(self, update):
+        await self.module.dp.feed_update(self.module.bot, types.Update(**update))
+
+    def state(self, user_id):
+        bot = self.module.bot
+        return FSMContext(bot=bot, storage=self.module.dp.storage, key=StorageKey(bot.id, user_id, user_id))
+
+    def sent(self, method=None, chat_id=None):
+        return [
+            call for call in self.stub["sent"]
+            if (method is None or call[0] == method) and (chat_id is None or call[1] == chat_id)
+        ]
+
+
+@pytest.fixture
+def run_bot(bot_module):
+    async def run(scenario, stub_options, outbox_options):
+        runner = web.AppRunner(stub_api_app(**stub_options))
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        bot_module.bot.session.api = TelegramAPIServer.from_base(
+            f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+        )
+        # Очередь отправки привязана к event loop, поэтому у каждого теста своя
+        rates = {"global_rate": 100000, "private_rate": 100000, "group_rate": 100000}
+        bot_module.outbox = Outbox(**{**rates, **outbox_options})
+        bot_module.outbox.start()
+        try:
+            return await scenario(BotHarness(bot_module, runner.app))
+        finally:
+            await bot_module.outbox.stop()
+            await bot_module.bot.session.close()
+            await runner.cleanup()
+
+    return lambda scenario, outbox=None, **stub_options: asyncio.run(run(scenario, stub_options, outbox or {}))
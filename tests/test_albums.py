@@ -0,0 +1,49 @@
+import asyncio
+
+from bench import GROUP_CHAT_ID
+
+PHOTOS = 5
+
+
+async def send_album(harness, user_id, product):
+    module = harness.module
+    state = harness.state(user_id)
+    await state.set_state(module.OrderStates.waiting_for_photo)
+    await state.set_data({"product": product, "large_description": "Старый диван"})
+    # Альбом приходит отдельными обновлениями почти одновременно
+    await asyncio.gather(*(
+        harness.feed(harness.updates.photo(user_id, media_group_id=f"album-{user_id}")) for _ in range(PHOTOS)
+    ))
+    while module.albums._tasks:
+        await asyncio.sleep(0.01)
+    return state
+
+
+def test_album_is_accepted_once(run_bot):
+    user_id = 63_001
+
+    async def scenario(harness):
+        state = await send_album(harness, user_id, "🧺 Один пакет мусора")
+        return harness, await state.get_data(), await state.get_state()
+
+    harness, data, final_state = run_bot(scenario)
+
+    replies = [text for _, _, text in harness.sent(chat_id=user_id)]
+    assert len(replies) == 1 and replies[0].startswith("💳 Оплата")
+    assert len(data["photos"]) == PHOTOS
+    assert final_state == harness.module.OrderStates.waiting_for_payment_proof.state
+
+
+def test_large_trash_album_is_posted_as_one_media_group(run_bot):
+    user_id = 63_002
+
+    async def scenario(harness):
+        await send_album(harness, user_id, "🛢 Крупный мусор")
+        return harness
+
+    harness = run_bot(scenario)
+
+    assert len(harness.sent("sendmediagroup", GROUP_CHAT_ID)) == 1
+    assert [text for _, _, text in harness.sent(chat_id=user_id)] == [
+        "📨 Заявка отправлена администратору. Ожидайте связи."
+    ]
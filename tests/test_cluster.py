@@ -0,0 +1,63 @@
+import asyncio
+
+from aiogram.fsm.storage.base import StorageKey
+
+from cluster import SharedAlbums, SharedDedup
+from fsm_storage import SQLiteStorage
+
+
+def test_forgotten_update_is_accepted_again(tmp_path):
+    async def scenario():
+        dedup = SharedDedup(str(tmp_path / "dedup.db"))
+        try:
+            first = await dedup.seen(1)
+            repeat = await dedup.seen(1)
+            await dedup.forget(1)  # очередь была полна — 503
+            redelivered = await dedup.seen(1)
+            return first, repeat, redelivered
+        finally:
+            await dedup.close()
+
+    assert asyncio.run(scenario()) == (False, True, False)
+
+
+def test_album_split_across_processes_is_committed_once(tmp_path):
+    # Два экземпляра на одной базе — как два процесса при WORKERS > 1
+    async def scenario():
+        workers = [SharedAlbums(str(tmp_path / "albums.db"), window=0.2) for _ in range(2)]
+        commits = []
+
+        async def commit(items):
+            commits.append(items)
+
+        try:
+            for n in range(6):
+                workers[n % 2].add((7, "album"), f"photo{n}", commit)
+                await asyncio.sleep(0.02)
+            while any(worker._tasks for worker in workers):
+                await asyncio.sleep(0.05)
+        finally:
+            for worker in workers:
+                await worker.close()
+        return commits
+
+    assert asyncio.run(scenario()) == [[f"photo{n}" for n in range(6)]]
+
+
+def test_shared_update_data_keeps_every_key(tmp_path):
+    key = StorageKey(bot_id=1, chat_id=2, user_id=2)
+
+    async def scenario():
+        workers = [SQLiteStorage(str(tmp_path / "fsm.db"), flush_interval=None, cache=False) for _ in range(2)]
+        try:
+            await asyncio.gather(*(
+                worker.update_data(None, key, {f"{i}:{n}": n})
+                for n in range(50)
+                for i, worker in enumerate(workers)
+            ))
+            return await workers[0].get_data(None, key)
+        finally:
+            for worker in workers:
+                await worker.close()
+
+    assert len(asyncio.run(scenario())) == 100
@@ -0,0 +1,76 @@
+import asyncio
+import sqlite3
+
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm_storage import SQLiteStorage, make_key
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+OTHER = StorageKey(bot_id=1, chat_id=20, user_id=20)
+
+
+def test_state_and_data_survive_reopen(tmp_path):
+    path = str(tmp_path / "fsm.db")
+
+    async def scenario():
+        storage = SQLiteStorage(path)
+        await storage.set_state(None, KEY, "OrderStates:waiting_for_address")
+        await storage.update_data(None, KEY, {"date": "01.01.2031", "time_slot": "10:00"})
+        await storage.close()
+
+        reopened = SQLiteStorage(path)
+        try:
+            return await reopened.get_state(None, KEY), await reopened.get_data(None, KEY)
+        finally:
+            await reopened.close()
+
+    assert asyncio.run(scenario()) == (
+        "OrderStates:waiting_for_address", {"date": "01.01.2031", "time_slot": "10:00"}
+    )
+
+
+def test_updates_within_flush_interval_are_one_write(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / "fsm.db"), flush_interval=0.1)
+        writes = []
+        write = storage._write
+        storage._write = lambda records: (writes.append(len(records)), write(records))[1]
+        try:
+            await storage.set_state(None, KEY, "OrderStates:waiting_for_photo")
+            for n in range(5):
+                await storage.update_data(None, KEY, {f"field{n}": n})
+            await asyncio.sleep(0.3)
+            return writes, await storage.get_data(None, KEY)
+        finally:
+            await storage.close()
+
+    writes, data = asyncio.run(scenario())
+
+    assert writes == [1]
+    assert data == {f"field{n}": n for n in range(5)}
+
+
+def test_purge_drops_stale_keys_from_db_and_cache(tmp_path):
+    path = str(tmp_path / "fsm.db")
+
+    async def scenario():
+        storage = SQLiteStorage(path)
+        try:
+            await storage.update_data(None, KEY, {"product": "🧺 Один пакет мусора"})
+            await storage.update_data(None, OTHER, {"product": "🛢 Крупный мусор"})
+            await storage.flush()
+            conn = sqlite3.connect(path)
+            with conn:
+                conn.execute("UPDATE fsm SET updated_at = 0 WHERE key = ?", (make_key(KEY),))
+            conn.close()
+
+            removed = await storage.purge(3600)
+            return removed, await storage.get_data(None, KEY), await storage.get_data(None, OTHER)
+        finally:
+            await storage.close()
+
+    removed, stale, fresh = asyncio.run(scenario())
+
+    assert removed == 1
+    assert stale == {}
+    assert fresh == {"product": "🛢 Крупный мусор"}
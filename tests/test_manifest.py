@@ -0,0 +1,85 @@
+from datetime import datetime
+
+import pytest
+import pytz
+
+from bench import ADMIN_ID, GROUP_CHAT_ID
+from manifest import group_by_address, parse_address
+from orders import encode_order_id
+
+
+@pytest.mark.parametrize("address, expected", [
+    ("ул. Ленина, д. 5 к2, кв. 10, подъезд 3", ("ленина", (5, "", 2))),
+    ("ул. Садовая дом 7а, этаж 3, код 123", ("садовая", (7, "а", 0))),
+    ("Ленина 12 кв 5", ("ленина", (12, "", 0))),
+    ("ул. 8 Марта, 14", ("8 марта", (14, "", 0))),
+    ("8 Марта 14б кв 5", ("8 марта", (14, "б", 0))),
+    ("2-я Тверская-Ямская ул., 10", ("2-я тверская-ямская", (10, "", 0))),
+    ("ул. 1905 года, д. 3, кв. 7", ("1905 года", (3, "", 0))),
+])
+def test_parse_address(address, expected):
+    assert parse_address(address) == expected
+
+
+def test_numbered_streets_are_not_merged():
+    orders = [{"address": "ул. 8 Марта, 14"}, {"address": "2-я Тверская-Ямская ул., 10"}]
+    assert [street for street, _ in group_by_address(orders)] == ["2-я тверская-ямская", "8 марта"]
+
+
+def msk(*args):
+    return pytz.timezone("Europe/Moscow").localize(datetime(*args))
+
+
+def test_slots_inside_manifest_lead_are_not_offered(run_bot, monkeypatch):
+    user_id = 61_001
+    monkeypatch.setattr("bot.now_msk", lambda: msk(2031, 3, 3, 9, 40))
+
+    async def scenario(harness):
+        await harness.state(user_id).set_data({"product": "🧺 Один пакет мусора"})
+        await harness.feed(harness.updates.callback(user_id, "date_03.03.2031"))
+        return harness.stub["keyboards"]
+
+    keyboards = run_bot(scenario)
+    offered = [
+        button["callback_data"]
+        for chat, markup in keyboards if chat == user_id
+        for row in markup["inline_keyboard"] for button in row
+    ]
+    # Маршрут на 10:00 ушёл в 9:30 (MANIFEST_LEAD_MINUTES = 30)
+    assert offered[0] == "time_11:00" and "time_10:00" not in offered
+
+
+def test_manifest_lists_only_paid_orders(run_bot):
+    async def scenario(harness):
+        store = harness.module.order_store
+        lifecycle = ["confirmed", "picked_up", "dumped"]
+        for n in range(4):  # pending_payment, confirmed, picked_up, dumped
+            order_id = await store.append({
+                "user_id": 61_100 + n, "date": "04.03.2031", "time_slot": "10:00",
+                "address": f"ул. Ленина, д. {n + 1}", "transfer": "Выставлен за дверь",
+            })
+            for status in lifecycle[:n]:
+                await store.advance(order_id, status)
+        await harness.module.post_manifest("04.03.2031", "10:00")
+        return harness
+
+    harness = run_bot(scenario)
+    [(_, _, text)] = harness.sent("sendmessage", GROUP_CHAT_ID)
+    assert "Заявок: 2" in text and "д. 2" in text and "д. 3" in text
+
+
+def test_late_confirmation_is_sent_as_manifest_addendum(run_bot, monkeypatch):
+    monkeypatch.setattr("bot.now_msk", lambda: msk(2031, 3, 5, 9, 40))
+
+    async def scenario(harness):
+        order_id = await harness.module.order_store.append({
+            "user_id": 61_200, "date": "05.03.2031", "time_slot": "10:00",
+            "address": "ул. Садовая, д. 7", "transfer": "Курьер поднимется",
+        })
+        ref = encode_order_id(order_id)
+        await harness.feed(harness.updates.callback(ADMIN_ID, f"confirm_{ref}", chat_id=GROUP_CHAT_ID))
+        return harness
+
+    harness = run_bot(scenario)
+    addenda = [text for _, _, text in harness.sent("sendmessage", GROUP_CHAT_ID) if "Дополнение к маршруту" in text]
+    assert len(addenda) == 1 and "д. 7" in addenda[0]
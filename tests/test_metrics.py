@@ -0,0 +1,30 @@
+import asyncio
+import cProfile
+
+import metrics
+from metrics import HandlerMetricsMiddleware
+
+
+def test_overlapping_updates_share_one_profiler(monkeypatch):
+    profilers = []
+
+    class CountingProfile(cProfile.Profile):
+        def __init__(self):
+            super().__init__()
+            profilers.append(self)
+
+    monkeypatch.setattr(metrics.cProfile, "Profile", CountingProfile)
+    middleware = HandlerMetricsMiddleware(slow_threshold=60, profile_rate=1.0)
+
+    async def handler(event, data):
+        await asyncio.sleep(0.01)
+
+    async def scenario():
+        await asyncio.gather(*(middleware(handler, None, {}) for _ in range(5)))
+        # Профиль снят — следующее обновление снова можно профилировать
+        await middleware(handler, None, {})
+
+    asyncio.run(scenario())
+
+    assert len(profilers) == 2
+    assert not metrics._profiling
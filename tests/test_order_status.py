@@ -0,0 +1,50 @@
+import asyncio
+
+from bench import ADMIN_ID, GROUP_CHAT_ID
+from orders import encode_order_id
+
+
+async def new_order(harness, user_id):
+    order_id = await harness.module.order_store.append({
+        "user_id": user_id, "date": "09.03.2031", "time_slot": "12:00",
+        "address": "ул. Лесная, д. 4", "transfer": "Выставлен за дверь",
+    })
+    return order_id, encode_order_id(order_id)
+
+
+def click(harness, action, ref):
+    return harness.feed(harness.updates.callback(ADMIN_ID, f"{action}_{ref}", chat_id=GROUP_CHAT_ID))
+
+
+def test_double_confirm_notifies_customer_once(run_bot):
+    user_id = 64_001
+
+    async def scenario(harness):
+        order_id, ref = await new_order(harness, user_id)
+        await asyncio.gather(click(harness, "confirm", ref), click(harness, "confirm", ref))
+        return harness, await harness.module.order_store.get(order_id)
+
+    harness, order = run_bot(scenario)
+
+    assert order["status"] == "confirmed"
+    assert [text for _, _, text in harness.sent(chat_id=user_id)] == [
+        "✅ Оплата подтверждена. Курьер в ближайшее время заберёт мусор."
+    ]
+    assert harness.stub["answers"].count("ℹ️ Статус этой заявки уже обновлён.") == 1
+
+
+def test_picked_up_after_dumped_is_rejected(run_bot):
+    user_id = 64_002
+
+    async def scenario(harness):
+        order_id, ref = await new_order(harness, user_id)
+        await click(harness, "confirm", ref)
+        await click(harness, "dumped", ref)
+        await click(harness, "pickedup", ref)
+        return harness, await harness.module.order_store.get(order_id)
+
+    harness, order = run_bot(scenario)
+
+    assert order["status"] == "dumped" and not order["picked_up_at"]
+    assert "✅ Курьер забрал мусор." not in [text for _, _, text in harness.sent(chat_id=user_id)]
+    assert harness.stub["answers"][-1] == "ℹ️ Статус этой заявки уже обновлён."
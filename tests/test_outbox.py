@@ -0,0 +1,109 @@
+import asyncio
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+from bench import stub_api_app
+from outbox import ADMIN, CUSTOMER, Outbox, OutboxClosed
+
+
+async def with_stub(scenario, **stub_options):
+    # Настоящий Bot с сессией aiohttp против заглушки Bot API
+    runner = web.AppRunner(stub_api_app(**stub_options))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    bot = Bot(token="123456:test", session=AiohttpSession(api=TelegramAPIServer.from_base(url)))
+    try:
+        return await scenario(bot, runner.app)
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+
+
+def test_retry_after_is_respected():
+    async def scenario(bot, stub):
+        outbox = Outbox(global_rate=100, private_rate=100)
+        outbox.start()
+        try:
+            message = await outbox.send(42, lambda: bot.send_message(42, "hello"))
+        finally:
+            await outbox.stop()
+        return message, outbox.stats(), stub["calls"]["limited"], stub["sent"]
+
+    message, stats, limited, sent = asyncio.run(with_stub(scenario, rate_limited=2, retry_after=1))
+
+    assert message.chat.id == 42
+    assert limited == 2
+    assert stats["retried"] == 2 and stats["sent"] == 1 and stats["failed"] == 0
+    assert sent == [("sendmessage", 42, "hello")]
+
+
+def test_retries_exhausted_raise_to_sender():
+    async def scenario(bot, stub):
+        outbox = Outbox(global_rate=100, private_rate=100, max_retries=0)
+        outbox.start()
+        try:
+            await outbox.send(42, lambda: bot.send_message(42, "hello"))
+        except Exception as e:
+            return type(e).__name__, outbox.stats()
+        finally:
+            await outbox.stop()
+
+    error, stats = asyncio.run(with_stub(scenario, rate_limited=1, retry_after=1))
+
+    assert error == "TelegramRetryAfter"
+    assert stats["failed"] == 1
+
+
+def test_customer_messages_go_before_admin_posts():
+    async def scenario(bot, stub):
+        outbox = Outbox(global_rate=100, private_rate=100)
+        # Всё ставится в очередь до запуска, отправка идёт в порядке приоритета
+        for i in range(3):
+            outbox.post(7, lambda i=i: bot.send_message(7, f"admin {i}"), priority=ADMIN)
+        sends = [
+            asyncio.ensure_future(outbox.send(7, lambda i=i: bot.send_message(7, f"customer {i}"), priority=CUSTOMER))
+            for i in range(3)
+        ]
+        await asyncio.sleep(0)
+        outbox.start()
+        await asyncio.gather(*sends)
+        while outbox.stats()["sent"] < 6:
+            await asyncio.sleep(0.01)
+        await outbox.stop()
+        return [text for _, _, text in stub["sent"]]
+
+    texts = asyncio.run(with_stub(scenario))
+
+    assert texts == ["customer 0", "customer 1", "customer 2", "admin 0", "admin 1", "admin 2"]
+
+
+def test_stop_fails_undelivered_sends_after_deadline():
+    async def scenario():
+        outbox = Outbox(global_rate=100, private_rate=100, group_rate=1 / 3)
+
+        async def hang():
+            await asyncio.sleep(3600)
+
+        async def ok():
+            return "ok"
+
+        outbox.start()
+        first = asyncio.ensure_future(outbox.send(-1, hang))  # висит в запросе
+        queued = [asyncio.ensure_future(outbox.send(-1, ok)) for _ in range(20)]  # ждут за блокировкой чата
+        await asyncio.sleep(0.1)
+        started = asyncio.get_running_loop().time()
+        await outbox.stop(timeout=0.2)
+        elapsed = asyncio.get_running_loop().time() - started
+        results = await asyncio.gather(first, *queued, return_exceptions=True)
+        return elapsed, results, outbox.stats()
+
+    elapsed, results, stats = asyncio.run(scenario())
+
+    assert elapsed < 1
+    assert all(isinstance(result, OutboxClosed) for result in results)
+    assert stats["failed"] == 21 and stats["in_flight"] == 0 and stats["queued"] == 0
@@ -0,0 +1,30 @@
+from bench import GROUP_CHAT_ID
+
+
+def test_receipt_is_acknowledged_only_after_admin_post(run_bot):
+    user_id = 60_001
+
+    async def scenario(harness):
+        module = harness.module
+        state = harness.state(user_id)
+        await state.set_state(module.OrderStates.waiting_for_payment_proof)
+        await state.set_data({
+            "product": "🧺 Один пакет мусора", "price": 100, "address": "ул. Ленина, д. 1",
+            "date": "02.02.2031", "time_slot": "10:00", "transfer": "Выставлен за дверь",
+        })
+        # Первая попытка: пост в группу не уходит (429, повторы исчерпаны)
+        await harness.feed(harness.updates.photo(user_id))
+        failed = [text for _, chat, text in harness.sent() if chat == user_id]
+        # Клиент присылает чек ещё раз — заказ не дублируется, пост уходит
+        await harness.feed(harness.updates.photo(user_id))
+        replies = [text for _, chat, text in harness.sent() if chat == user_id]
+        orders = await module.order_store.query(user_id=user_id)
+        return failed, replies, orders, harness.sent("sendphoto", GROUP_CHAT_ID), await state.get_state()
+
+    failed, replies, orders, posts, final_state = run_bot(scenario, outbox={"max_retries": 0}, rate_limited=1)
+
+    assert failed == ["❗ Произошла ошибка. Попробуйте снова или обратитесь к администратору."]
+    assert replies[-1] == "✅ Чек получен. Ожидайте подтверждения от администратора."
+    assert len(orders) == 1 and orders[0]["status"] == "pending_payment"
+    assert len(posts) == 1 and "Новая заявка" in posts[0][2]
+    assert final_state is None
@@ -0,0 +1,79 @@
+import asyncio
+import sqlite3
+import time
+
+from orders import SLOT_CAPACITY, OrderStore, ReservationBook, SlotIndex
+
+DATE = "01.01.2030"
+SLOT = "10:00"
+
+
+def count_holds(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(
+            "SELECT COUNT(*) FROM holds WHERE date = ? AND time_slot = ?", (DATE, SLOT)
+        ).fetchone()[0]
+    finally:
+        conn.close()
+
+
+async def reserve_all(path, shared, users=300):
+    store = OrderStore(path)
+    await store.open()
+    book = ReservationBook(store, SlotIndex(), shared=shared)
+    try:
+        results = await asyncio.gather(*(book.reserve(user_id, DATE, SLOT) for user_id in range(users)))
+        return book, results
+    finally:
+        await store.close()
+
+
+def test_concurrent_reserve_never_exceeds_capacity(tmp_path):
+    path = str(tmp_path / "orders.db")
+    book, results = asyncio.run(reserve_all(path, shared=False))
+
+    assert sum(results) == SLOT_CAPACITY
+    assert book.taken(DATE, SLOT) == SLOT_CAPACITY
+    assert count_holds(path) == SLOT_CAPACITY
+
+
+def test_concurrent_reserve_shared_never_exceeds_capacity(tmp_path):
+    path = str(tmp_path / "orders.db")
+    _, results = asyncio.run(reserve_all(path, shared=True))
+
+    assert sum(results) == SLOT_CAPACITY
+    assert count_holds(path) == SLOT_CAPACITY
+
+
+def test_expired_holds_are_not_subtracted_twice():
+    book = ReservationBook(store=None, index=SlotIndex())
+    now = time.time()
+    book._claim(1, DATE, SLOT, now - 10)
+    book._claim(2, DATE, SLOT, now - 10)
+    book._claim(3, DATE, SLOT, now + 600)
+
+    assert book.taken(DATE, SLOT, now) == 1
+
+
+def test_concurrent_time_callbacks_through_dispatcher(run_bot):
+    # 300 пользователей одновременно жмут одно и то же время — через обработчик choose_time
+    date = "07.03.2031"
+    users = range(62_000, 62_300)
+
+    async def scenario(harness):
+        module = harness.module
+        for user_id in users:
+            state = harness.state(user_id)
+            await state.set_state(module.OrderStates.waiting_for_time)
+            await state.set_data({"product": "🧺 Один пакет мусора", "date": date})
+        await asyncio.gather(*(harness.feed(harness.updates.callback(user_id, f"time_{SLOT}")) for user_id in users))
+        held = module.reservations.taken(date, SLOT)
+        states = [await harness.state(user_id).get_state() for user_id in users]
+        return held, harness.stub["answers"], states, module.OrderStates.waiting_for_address.state
+
+    held, answers, states, next_state = run_bot(scenario)
+
+    assert held == SLOT_CAPACITY
+    assert answers.count("❌ Это время уже занято. Выберите другое.") == len(users) - SLOT_CAPACITY
+    assert states.count(next_state) == SLOT_CAPACITY
@@ -0,0 +1,80 @@
+import asyncio
+import sqlite3
+import time
+from datetime import timedelta
+
+from scheduler import Scheduler
+
+
+def recorder(calls):
+    async def handler(job):
+        calls.append(job)
+    return handler
+
+
+def test_jobs_survive_restart_and_overdue_run_on_start(tmp_path):
+    path = str(tmp_path / "jobs.db")
+
+    async def before_restart():
+        # Незапущенный планировщик только сохраняет задачи
+        scheduler = Scheduler(path)
+        await scheduler.schedule("reminder", time.time() - 60, {"order_id": 1}, job_id="overdue")
+        await scheduler.schedule("reminder", time.time() + 3600, {"order_id": 2}, job_id="later")
+        await scheduler.stop()
+
+    async def after_restart():
+        calls = []
+        scheduler = Scheduler(path)
+        scheduler.register("reminder", recorder(calls))
+        await scheduler.start()
+        await asyncio.sleep(0.1)
+        pending = scheduler.pending()
+        await scheduler.stop()
+        return calls, pending
+
+    asyncio.run(before_restart())
+    calls, pending = asyncio.run(after_restart())
+    conn = sqlite3.connect(path)
+    remaining = [row[0] for row in conn.execute("SELECT id FROM jobs")]
+    conn.close()
+
+    assert [(job["id"], job["payload"]) for job in calls] == [("overdue", {"order_id": 1})]
+    assert pending == 1
+    assert remaining == ["later"]
+
+
+def test_recurring_job_reschedules_itself(tmp_path):
+    async def scenario():
+        calls = []
+        scheduler = Scheduler(str(tmp_path / "jobs.db"))
+        scheduler.every("tick", recorder(calls), lambda now: now + timedelta(seconds=0.05))
+        await scheduler.start()
+        await asyncio.sleep(0.4)
+        pending = scheduler.pending()
+        await scheduler.stop()
+        return calls, pending
+
+    calls, pending = asyncio.run(scenario())
+
+    assert len(calls) >= 3
+    assert pending == 1
+
+
+def test_cancelled_and_rescheduled_heap_entries_are_skipped(tmp_path):
+    async def scenario():
+        calls = []
+        scheduler = Scheduler(str(tmp_path / "jobs.db"))
+        scheduler.register("job", recorder(calls))
+        await scheduler.start()
+        now = time.time()
+        await scheduler.schedule("job", now + 0.05, job_id="cancelled")
+        await scheduler.schedule("job", now + 0.05, job_id="moved")
+        await scheduler.schedule("job", now + 0.2, job_id="moved")  # прежняя запись в куче устарела
+        await scheduler.cancel("cancelled")
+        await asyncio.sleep(0.4)
+        await scheduler.stop()
+        return now, calls
+
+    now, calls = asyncio.run(scenario())
+
+    assert [(job["id"], job["run_at"]) for job in calls] == [("moved", now + 0.2)]
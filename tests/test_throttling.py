@@ -0,0 +1,70 @@
+import time
+
+from aiogram import Dispatcher, F, types
+from aiogram.types import CallbackQuery
+
+from bench import ADMIN_ID, GROUP_CHAT_ID
+from throttling import ThrottlingMiddleware, throttled_updates
+
+
+def throttled_dispatcher(bot_module):
+    # Отдельный диспетчер с настройками бота: в тестах bot.py запущен с THROTTLE=0
+    dp = Dispatcher()
+    throttling = ThrottlingMiddleware(bot_module.THROTTLE_LIMITS, bot_module.THROTTLE_CLASSES)
+    dp.callback_query.middleware(throttling)
+
+    @dp.callback_query(F.data.startswith("time_"))
+    async def choose_time(callback: CallbackQuery):
+        await callback.answer("ok")
+
+    @dp.callback_query(F.data.startswith("confirm_"))
+    async def confirm_payment(callback: CallbackQuery):
+        await callback.answer("ok")
+
+    return dp
+
+
+def test_excess_callbacks_get_empty_answer(run_bot):
+    user_id = 66_001
+    before = throttled_updates.values.get(("navigation",), 0)
+
+    async def scenario(harness):
+        dp = throttled_dispatcher(harness.module)
+        for _ in range(10):
+            await dp.feed_update(harness.module.bot, types.Update(**harness.updates.callback(user_id, "time_10:00")))
+        return harness.stub["answers"]
+
+    answers = run_bot(scenario)
+
+    burst = 6  # THROTTLE_LIMITS["navigation"]
+    assert answers == ["ok"] * burst + [""] * (10 - burst)
+    assert throttled_updates.values[("navigation",)] - before == 10 - burst
+
+
+def test_admin_buttons_are_never_throttled(run_bot):
+    async def scenario(harness):
+        dp = throttled_dispatcher(harness.module)
+        for n in range(30):
+            update = harness.updates.callback(ADMIN_ID, f"confirm_{n}", chat_id=GROUP_CHAT_ID)
+            await dp.feed_update(harness.module.bot, types.Update(**update))
+        return harness.stub["answers"]
+
+    assert run_bot(scenario) == ["ok"] * 30
+
+
+def test_buckets_are_bounded_and_expire():
+    limit = (10, 5)
+    throttling = ThrottlingMiddleware({"default": limit}, max_entries=100)
+
+    def touch(user_id, now):
+        # Как в __call__: найти ведро и взять токен
+        throttling._bucket((user_id, "default"), limit, now).try_acquire(now)
+
+    now = time.monotonic()
+    for user_id in range(1000):
+        touch(user_id, now)
+    assert throttling.stats() == {"tracked": 100, "evicted": 900}
+
+    # Ведро, не тронутое дольше burst / rate = 0.5 с, снова полное — его запись удаляется
+    touch("fresh", now + 1.0)
+    assert list(throttling._buckets) == [("fresh", "default")]
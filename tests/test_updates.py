@@ -0,0 +1,78 @@
+import asyncio
+import random
+
+from aiogram import types
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from bench import Updates
+from updates import UpdateQueue
+
+
+def make_updates(users, per_user):
+    updates = Updates()
+    # Обновления пользователей вперемешку, как их присылает Telegram
+    return [types.Update(**updates.text(user_id, f"{n}")) for n in range(per_user) for user_id in users]
+
+
+def test_updates_of_one_user_are_processed_in_order():
+    users = range(1, 9)
+    handled = {user_id: [] for user_id in users}
+
+    async def process(update):
+        await asyncio.sleep(random.random() / 1000)
+        handled[update.message.from_user.id].append(update.update_id)
+
+    async def scenario():
+        queue = UpdateQueue(process, workers=4)
+        queue.start()
+        for update in make_updates(users, 25):
+            assert queue.put(update)
+        await queue.stop()
+        return queue.stats()
+
+    stats = asyncio.run(scenario())
+
+    assert stats["processed"] == 200
+    assert all(len(ids) == 25 and ids == sorted(ids) for ids in handled.values())
+
+
+def test_repeated_update_id_is_processed_once():
+    handled = []
+
+    async def process(update):
+        handled.append(update.update_id)
+
+    async def scenario():
+        queue = UpdateQueue(process, workers=2)
+        queue.start()
+        update = make_updates([1], 1)[0]
+        accepted = [queue.put(update), queue.put(update)]
+        await queue.stop()
+        return update.update_id, accepted, queue.stats()
+
+    update_id, accepted, stats = asyncio.run(scenario())
+
+    assert accepted == [True, True]  # повтор подтверждаем Telegram, но не обрабатываем
+    assert handled == [update_id]
+    assert stats["duplicates"] == 1
+
+
+def test_full_shard_is_rejected_with_503(bot_module, monkeypatch):
+    # Обработчики не запущены — очередь на одно обновление переполняется вторым
+    monkeypatch.setattr(bot_module, "WEBHOOK_MODE", "queue")
+    monkeypatch.setattr(bot_module, "update_queue", UpdateQueue(bot_module.process_update, workers=1, maxsize=1))
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_post("/webhook", bot_module.webhook_handler)
+        async with TestClient(TestServer(app)) as client:
+            updates = Updates()
+            responses = []
+            for update in updates.text(65_001, "a"), updates.text(65_002, "b"):
+                response = await client.post("/webhook", json=update)
+                responses.append((response.status, response.headers.get("Retry-After")))
+            return responses
+
+    assert asyncio.run(scenario()) == [(200, None), (503, "1")]
+    assert bot_module.update_queue.stats()["rejected"] == 1
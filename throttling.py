@@ -0,0 +1,70 @@
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery
+
+from metrics import registry
+from ratelimit import TokenBucket
+
+throttled_updates = registry.counter(
+    "bot_throttled_updates_total", "Обновления, отброшенные ограничением частоты", ("handler_class",)
+)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    # 🚦 Защита от флуда: у каждого пользователя своё ведро токенов на каждый класс обработчиков.
+    # limits — {класс: (токенов в секунду, запас)}, None — без ограничения;
+    # classes — {имя обработчика: класс}, остальные обработчики попадают в класс "default".
+    # Лишние нажатия на кнопки гасятся пустым ответом, лишние сообщения просто отбрасываются.
+    #
+    # Ведро, к которому не обращались дольше burst / rate секунд, снова полное и
+    # ничем не отличается от нового, поэтому такие записи удаляются без потери точности.
+    # Кроме того, записей не больше max_entries (LRU) — миллионы разных user_id
+    # не раздувают память.
+
+    def __init__(self, limits, classes=None, max_entries=100000):
+        self.limits = limits
+        self.classes = classes or {}
+        self.max_entries = max_entries
+        self.ttl = max((burst / rate for rate, burst in filter(None, limits.values())), default=0)
+        self._buckets = OrderedDict()  # (user_id, класс) -> ведро
+        self.evicted = 0
+
+    def _bucket(self, key, limit, now):
+        # Вычищаем с начала очереди: там записи, к которым дольше всего не обращались
+        while self._buckets:
+            oldest_key, oldest = next(iter(self._buckets.items()))
+            if len(self._buckets) < self.max_entries and now - oldest.updated < self.ttl:
+                break
+            del self._buckets[oldest_key]
+            self.evicted += 1
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(*limit)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        handler_class = self.classes.get(name, "default")
+        limit = self.limits.get(handler_class)
+        user = getattr(event, "from_user", None)
+        if limit is None or user is None:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        bucket = self._bucket((user.id, handler_class), limit, now)
+        if bucket.try_acquire(now):
+            return await handler(event, data)
+
+        throttled_updates.inc(handler_class)
+        if isinstance(event, CallbackQuery):
+            # Убираем «часики» на кнопке, ничего не показывая
+            await event.answer()
+        return None
+
+    def stats(self):
+        return {"tracked": len(self._buckets), "evicted": self.evicted}
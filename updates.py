@@ -0,0 +1,144 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+def update_chat_key(update):
+    # Обновления одного пользователя всегда попадают к одному обработчику
+    try:
+        event = update.event
+    except LookupError:
+        return update.update_id
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    chat = getattr(event, "chat", None)
+    if chat is not None:
+        return chat.id
+    return update.update_id
+
+
+class UpdateQueue:
+    # 📥 Очередь входящих обновлений для быстрого ответа Telegram.
+    # Вебхук только кладёт обновление в очередь, а workers обработчиков
+    # разбирают её в фоне. Каждый обработчик владеет своей ограниченной
+    # очередью, и обновления одного чата идут строго по порядку.
+    # Повторные update_id отбрасываются, переполнение видно вызывающему коду.
+
+    def __init__(self, process, workers=4, maxsize=1000, dedup_size=10000):
+        self.process = process
+        self.dedup_size = dedup_size
+        self._queues = [asyncio.Queue(maxsize=max(1, maxsize // workers)) for _ in range(workers)]
+        self._tasks = []
+        self._seen = OrderedDict()
+
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def put(self, update):
+        if update.update_id in self._seen:
+            self.duplicates += 1
+            return True
+
+        queue = self._queues[hash(update_chat_key(update)) % len(self._queues)]
+        try:
+            queue.put_nowait((time.monotonic(), update))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+
+        self.received += 1
+        self._seen[update.update_id] = None
+        if len(self._seen) > self.dedup_size:
+            self._seen.popitem(last=False)
+        return True
+
+    async def _work(self, queue):
+        while True:
+            enqueued_at, update = await queue.get()
+            self.last_lag = time.monotonic() - enqueued_at
+            self.max_lag = max(self.max_lag, self.last_lag)
+            try:
+                await self.process(update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"[Ошибка обработки обновления {update.update_id}] {e}")
+            finally:
+                queue.task_done()
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._work(queue)) for queue in self._queues]
+
+    async def join(self):
+        # Ждём, пока будет обработано всё, что уже принято
+        await asyncio.gather(*(queue.join() for queue in self._queues))
+
+    async def stop(self, timeout=10):
+        # Даём дообработать то, что уже принято, затем останавливаем workers
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"[Очередь] Не обработано при остановке: {self.depth()}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def depth(self):
+        return sum(queue.qsize() for queue in self._queues)
+
+    def stats(self):
+        return {
+            "depth": self.depth(),
+            "workers": len(self._queues),
+            "received": self.received,
+            "processed": self.processed,
+            "failed": self.failed,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "last_lag_seconds": round(self.last_lag, 4),
+            "max_lag_seconds": round(self.max_lag, 4),
+        }
+
+
+class AlbumCollector:
+    # 🖼 Сборка альбома (media_group_id) из отдельных обновлений.
+    # Фото копятся, пока в течение window секунд не перестанут приходить новые,
+    # затем commit(items) вызывается один раз для всего альбома.
+    # Обработчик не ждёт окончания сбора, поэтому остальные фото альбома
+    # не блокируются за ним в очереди обновлений.
+
+    def __init__(self, window=0.5, max_wait=5.0):
+        self.window = window
+        self.max_wait = max_wait
+        self._albums = {}
+        self._tasks = set()
+
+    def add(self, key, item, commit):
+        album = self._albums.get(key)
+        if album is not None:
+            album.append(item)
+            return
+        self._albums[key] = [item]
+        task = asyncio.create_task(self._collect(key, commit))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _collect(self, key, commit):
+        album = self._albums[key]
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            size = len(album)
+            await asyncio.sleep(self.window)
+            if len(album) == size or time.monotonic() >= deadline:
+                break
+        del self._albums[key]
+        try:
+            await commit(album)
+        except Exception as e:
+            print(f"[Ошибка обработки альбома {key}] {e}")